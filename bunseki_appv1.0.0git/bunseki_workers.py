@@ -0,0 +1,228 @@
+# ワーカープロセスで実行する処理
+# Streamlit はスクリプトを再実行のたびに新しい __main__ モジュールとして読み込むため、
+# スクリプト内で定義したクラスの関数はワーカーへ安定して渡せない。
+# プロセスプールに渡す関数はこのモジュールに置き、ここでは Streamlit の API を呼ばない
+import io
+import os
+import codecs
+import functools
+from contextlib import contextmanager
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.font_manager as fm
+
+
+class CsvIngest:
+    # 文字コード判定に使う先頭サンプルのサイズ
+    ENCODING_SAMPLE_BYTES = 1 << 16
+
+    @staticmethod
+    def detect_encoding(raw):
+        # BOM と先頭の一部だけを見て文字コードを判定する
+        if raw.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        sample = raw[:CsvIngest.ENCODING_SAMPLE_BYTES]
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            # サンプル末尾で途切れたマルチバイト文字はエラーにしない
+            decoder.decode(sample, final=len(sample) == len(raw))
+            return 'utf-8-sig'
+        except UnicodeDecodeError:
+            return 'cp932'
+
+    @staticmethod
+    def ingest_file(file, chunksize=None):
+        # 1ファイル分の読み込み・型変換・派生列計算
+        # 結果は取り込みキャッシュのエントリ形式で返す
+        encoding = CsvIngest.detect_encoding(file.getvalue())
+        try:
+            df, coerced_dates = CsvIngest.read_typed_csv(file, encoding, chunksize)
+        except UnicodeDecodeError:
+            # サンプル以降に UTF-8 として不正なバイトがあった場合のみ cp932 で読み直す
+            if encoding == 'cp932':
+                return CsvIngest.error_entry("読み込みエラー: 文字コードを判定できませんでした")
+            try:
+                encoding = 'cp932'
+                df, coerced_dates = CsvIngest.read_typed_csv(file, encoding, chunksize)
+            except Exception as e:
+                return CsvIngest.error_entry(f"読み込みエラー: {str(e)}")
+        except Exception as e:
+            return CsvIngest.error_entry(f"読み込みエラー: {str(e)}")
+
+        return {
+            'df': df,
+            'rows': len(df),
+            'error': None,
+            'encoding': encoding,
+            'coerced_dates': coerced_dates
+        }
+
+    @staticmethod
+    def ingest_bytes(raw, chunksize=None):
+        # ワーカープロセス用: アップロードファイルの代わりにバイト列を受け取る
+        return CsvIngest.ingest_file(io.BytesIO(raw), chunksize)
+
+    @staticmethod
+    def error_entry(error):
+        return {'df': None, 'rows': 0, 'error': error, 'encoding': None, 'coerced_dates': 0}
+
+    @staticmethod
+    def read_typed_csv(file, encoding, chunksize=None):
+        # 判定した文字コードで一度だけパースする
+        file.seek(0)
+        if not chunksize:
+            df = pd.read_csv(
+                file,
+                encoding=encoding,
+                on_bad_lines='warn',
+            )
+            return CsvIngest.type_columns(df)
+        return CsvIngest.read_csv_streaming(file, encoding, chunksize)
+
+    @staticmethod
+    def read_csv_streaming(file, encoding, chunksize):
+        # 大容量ファイル向け: チャンク単位で型変換・派生列を計算し、列ごとのバッファに追記する
+        # 全体を一度に読み込んでから列をコピーする場合に比べ、ピークメモリを最終的なデータ量に近づける
+        # 実施日の書式はチャンクごとに推定すると結果が読み込み方で変わるため、結合後に一度だけ変換する
+        buffers = {}
+        with pd.read_csv(
+            file,
+            encoding=encoding,
+            on_bad_lines='warn',
+            chunksize=chunksize,
+        ) as reader:
+            for chunk in reader:
+                chunk, _ = CsvIngest.type_columns(chunk, parse_dates=False)
+                for col in chunk.columns:
+                    buffers.setdefault(col, []).append(chunk[col])
+                del chunk
+
+        # 列ごとに結合し、結合済みのチャンクはすぐに解放する
+        columns = {}
+        for col in list(buffers):
+            columns[col] = pd.concat(buffers.pop(col), ignore_index=True)
+        df = pd.DataFrame(columns, copy=False)
+        return df, CsvIngest.parse_dates(df)
+
+    @staticmethod
+    def type_columns(df, parse_dates=True):
+        # 型変換と派生列の計算（ファイル全体でもチャンク単位でも同じ処理）
+        # 戻り値: (df, 日付として認識できなかった行数)
+        coerced_dates = CsvIngest.parse_dates(df) if parse_dates else 0
+
+        numeric_cols = ['申込数', '参加者数', 'リアクション数', '宣伝回数', '満足回答']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce') 
+        
+        if all(col in df.columns for col in ['参加者数', '申込数']):
+            df['参加率(%)'] = (df['参加者数'] / df['申込数']) * 100
+        if all(col in df.columns for col in ['満足回答', '参加者数']):
+            df['満足率(%)'] = (df['満足回答'] / df['参加者数']) * 100
+        if all(col in df.columns for col in ['リアクション数', '参加者数']):
+            df['リアクション率'] = df['リアクション数'] / df['参加者数']
+        
+        return df, coerced_dates
+
+    @staticmethod
+    def parse_dates(df):
+        # 実施日列を日付に変換し、日付として認識できなかった行数を返す
+        if '実施日' not in df.columns:
+            return 0
+        # 実施日列の変換とNaNチェックを追加
+        initial_nan_count = df['実施日'].isnull().sum()
+        df['実施日'] = pd.to_datetime(df['実施日'], errors='coerce')
+        # 時間部分を削除し、日付のみにする（datetime64 のまま保持する）
+        df['実施日'] = df['実施日'].dt.normalize()
+
+        nan_after_coerce = df['実施日'].isnull().sum()
+        return max(int(nan_after_coerce - initial_nan_count), 0)
+
+
+class ChartDrawing:
+    # 全チャート共通のスタイル（描画中だけ rc_context で適用する）
+    # マイナス記号の文字化けを防ぐ。日本語フォントは style() で先頭に加える
+    STYLE = {
+        'font.family': 'sans-serif',
+        'axes.unicode_minus': False,
+        'font.size': 10
+    }
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def register_font(path):
+        # フォントマネージャーへの登録はプロセスごとに一度だけ行い、登録したフォント名を返す（見つからなければ None）
+        if not os.path.exists(path):
+            return None
+        fm.fontManager.addfont(path)
+        return fm.FontProperties(fname=path).get_name()
+
+    @staticmethod
+    def style(font_name):
+        # 日本語フォントを優先したチャートのスタイル
+        return {
+            **ChartDrawing.STYLE,
+            'font.sans-serif': ([font_name] if font_name else []) + matplotlib.rcParams['font.sans-serif']
+        }
+
+    @staticmethod
+    @contextmanager
+    def figure(figsize, style):
+        # pyplot の図の一覧に登録しない Figure を作り、描画が終わったら（例外時も）必ず解放する
+        # 共通のスタイルは作成から保存までの間だけ適用する（テキストは作成時の設定でフォントが決まる）
+        with matplotlib.rc_context(style):
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            try:
+                yield fig, fig.add_subplot()
+            finally:
+                fig.clear()
+
+    @staticmethod
+    def draw(spec, data, ax):
+        # 仕様どおりに ax に描く（line は data に系列のリスト、それ以外は Series か DataFrame を渡す）
+        kind = spec['kind']
+        if kind in ('bar', 'barh'):
+            data.plot(kind=kind, ax=ax)
+        elif kind == 'count':
+            sns.barplot(x=[str(value) for value in data.index], y=data.to_numpy(), ax=ax)
+        elif kind == 'heatmap':
+            sns.heatmap(
+                data,
+                cmap=spec['cmap'],
+                annot=spec['annot'],
+                fmt='.2f',
+                vmin=spec.get('vmin'),
+                vmax=spec.get('vmax'),
+                linewidths=.5,
+                linecolor='black',
+                ax=ax
+            )
+        elif kind == 'line':
+            for series, (label, style) in zip(data, spec['lines']):
+                series.plot(ax=ax, label=label, style=style)
+            ax.legend()
+
+        ax.set_title(spec['title'], **spec.get('title_font', {}))
+        ax.set_xlabel(spec['xlabel'], **spec.get('label_font', {}))
+        ax.set_ylabel(spec['ylabel'], **spec.get('label_font', {}))
+        if spec.get('rotation'):
+            ax.tick_params(axis='x', labelrotation=spec['rotation'])
+            if 'ha' in spec:
+                for label in ax.get_xticklabels():
+                    label.set_horizontalalignment(spec['ha'])
+        ax.figure.tight_layout()
+
+    @staticmethod
+    def render(spec, data, fmt, dpi, font_path):
+        # 仕様から画像のバイト列を作る（ワーカープロセスでは最初の描画のときにフォントを登録する）
+        buf = io.BytesIO()
+        style = ChartDrawing.style(ChartDrawing.register_font(font_path))
+        with ChartDrawing.figure(spec['figsize'], style) as (fig, ax):
+            ChartDrawing.draw(spec, data, ax)
+            fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches='tight')
+        return buf.getvalue()
@@ -1,50 +1,33 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import numpy as np
-import io
 from datetime import datetime
+from contextlib import contextmanager
 import json
 import re
+import hashlib
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import bcrypt
-import matplotlib.font_manager as fm # フォントマネージャーをインポート
 import os
+from bunseki_workers import CsvIngest, ChartDrawing
 
-# このファイルと同じ階層に static フォルダがある場合
-font_path = os.path.join(os.path.dirname(__file__), "static", "NotoSansJP-VariableFont_wght.ttf")
-# 絶対パスに変換（これが一番安全！）
-font_path = os.path.abspath(font_path)
-
-if os.path.exists(font_path):
-    font_prop = fm.FontProperties(fname=font_path)
-    plt.rcParams["font.family"] = font_prop.get_name()
-    japanese_font_available = True
-else:
-    font_prop = None
-    japanese_font_available = False
-    st.warning("日本語フォントが見つかりませんでした。グラフのラベルが文字化けする可能性があります。")
+# 各画面はセッションのデータをコピーせずに共有する。列の追加などの書き込みが共有データに
+# 波及しないよう copy-on-write を有効にする（pandas 3 以降は既定で有効）
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
-# matplotlibのフォント設定
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams['font.size'] = 10
-
-# フォント読み込みチェック
-if os.path.exists(font_path):
-    #font_prop = fm.FontProperties(fname=font_path)
-    #font_name = font_prop.get_name()
-    #plt.rcParams['font.family'] = font_name  # ← matplotlib 全体に強制反映！
-    #japanese_font_available = True
-    #st.info(f"日本語フォント '{font_name}' を使用します。")
-    pass
-else:
-    font_prop = None
-    japanese_font_available = False
-    st.warning("日本語フォントが見つかりませんでした。グラフのラベルが文字化けする可能性があります。")
+# このファイルと同じ階層の static フォルダにある日本語フォント
+font_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "static", "NotoSansJP-VariableFont_wght.ttf"))
 
-# matplotlib のマイナス記号文字化け対策
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams['font.size'] = 10
+# フォントの登録とチャートのスタイルは、ワーカープロセスと共通の ChartDrawing で行う
+japanese_font_name = ChartDrawing.register_font(font_path)
+japanese_font_available = japanese_font_name is not None
+if not japanese_font_available:
+    st.warning("日本語フォントが見つかりませんでした。グラフのラベルが文字化けする可能性があります。")
 
 # UIテキストは常に日本語
 def get_localized_text(jp_text): # 英語引数を削除
@@ -132,7 +115,31 @@ class SessionManager:
             'dfmain': None,
             'uploaded_file_processed': False,
             'num_uploaders': 1,
-            'previous_files_hash': None
+            'previous_files_hash': None,
+            'ingest_cache': {},
+            'upload_digests': [],
+            'stream_ingest': False,
+            'stream_chunksize': 100_000,
+            'pool_workers': min(4, os.cpu_count() or 1),
+            'dataset_digests': [],
+            'row_hashes': None,
+            'column_kinds': {},
+            'slot_bridge': None,
+            'dataset_version': 0,
+            'filter_index': None,
+            'filter_cache': {},
+            'filter_key': None,
+            'result_cache': {},
+            'group_cube': {},
+            'cross_active': None,
+            'heatmap_store': None,
+            'heatmap_view': {},
+            'rank_active': None,
+            'approx_stats': False,
+            'sketches': {},
+            'sketch_view': {},
+            'column_profile': None,
+            'outlier_store': {}
         }
         
         for var, default in session_vars.items():
@@ -140,977 +147,2421 @@ class SessionManager:
                 st.session_state[var] = default
 
 class DataProcessor:
+    ENCODING_LABELS = {
+        'utf-8-sig': 'UTF-8',
+        'cp932': 'Shift_JIS (cp932)',
+    }
+
     @staticmethod
-    def safe_read_csv(file):
-        try:
-            df = pd.read_csv(
-                file,
-                encoding='utf-8-sig',
-                on_bad_lines='warn',
-            )
-            return df, None
-        except UnicodeDecodeError:
-            try:
-                df = pd.read_csv(
-                    file,
-                    encoding='cp932',
-                    on_bad_lines='warn',
-                )
-                return df, None
-            except Exception as e:
-                return None, get_localized_text(f"読み込みエラー: {str(e)}")
-        except Exception as e:
-            return None, get_localized_text(f"読み込みエラー: {str(e)}")
+    def file_digest(file):
+        # ファイル内容（バイト列）からキャッシュキーとなるハッシュ値を計算
+        return hashlib.blake2b(file.getvalue(), digest_size=16).hexdigest()
 
     @staticmethod
-    def process_dataframe(df):
-        if df is None:
-            return None
-            
-        if '実施日' in df.columns:
-            # 実施日列の変換とNaNチェックを追加
-            initial_nan_count = df['実施日'].isnull().sum()
-            df['実施日'] = pd.to_datetime(df['実施日'], errors='coerce')
-            # 時間部分を削除し、日付のみにする（.dt.normalize()を追加）
-            df['実施日'] = df['実施日'].dt.normalize().dt.date 
-
-            nan_after_coerce = df['実施日'].isnull().sum()
-            
-            if nan_after_coerce > initial_nan_count:
-                newly_coerced_nan_percentage = (nan_after_coerce - initial_nan_count) / len(df) * 100
-                if newly_coerced_nan_percentage > 10: # 例えば10%以上の値が無効になった場合に警告
-                    st.warning(get_localized_text(
-                        f"「実施日」列の{newly_coerced_nan_percentage:.1f}%が日付として認識できませんでした。元のデータ形式を確認してください。"
-                    ))
+    def load_files(files, digests, chunksize=None, workers=1):
+        # 内容ハッシュをキーにした取り込みキャッシュ
+        # 同じ内容のファイルはセッション中に一度だけ読み込み・型変換する
+        # 未読み込みのファイルが複数あればプロセスプールで並列に処理する
+        cache = st.session_state.ingest_cache
+        pending = {}
+        for f, digest in zip(files, digests):
+            if digest not in cache and digest not in pending:
+                pending[digest] = f
+
+        if pending:
+            entries = None
+            if workers > 1 and len(pending) > 1:
+                entries = ProcessPool.run(
+                    CsvIngest.ingest_bytes, [(f.getvalue(), chunksize) for f in pending.values()], workers
+                )
+            if entries is None:
+                entries = [CsvIngest.ingest_file(f, chunksize) for f in pending.values()]
+            for digest, entry in zip(pending, entries):
+                cache[digest] = entry
+                DataProcessor.warn_coerced_dates(entry)
 
-        numeric_cols = ['申込数', '参加者数', 'リアクション数', '宣伝回数', '満足回答']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce') 
-        
-        if all(col in df.columns for col in ['参加者数', '申込数']):
-            df['参加率(%)'] = (df['参加者数'] / df['申込数']) * 100
-        if all(col in df.columns for col in ['満足回答', '参加者数']):
-            df['満足率(%)'] = (df['満足回答'] / df['参加者数']) * 100
-        if all(col in df.columns for col in ['リアクション数', '参加者数']):
-            df['リアクション率'] = df['リアクション数'] / df['参加者数']
-        
-        return df
+        # アップローダーの順番どおりに返す
+        return [cache[digest] for digest in digests]
 
     @staticmethod
-    def expand_time_slots(df):
-        if '時間帯' in df.columns:
-            df['時間帯'] = df['時間帯'].astype(str)
-            df['時間帯スロット'] = df['時間帯'].str.split('・')
-            df = df.explode('時間帯スロット').reset_index(drop=True) # インデックスのリセットを追加
-            df['時間帯スロット'] = df['時間帯スロット'].str.strip()
-        return df
+    def prune_cache(digests):
+        # 現在アップロードされていないファイルのキャッシュを破棄してメモリを解放
+        cache = st.session_state.ingest_cache
+        for key in [k for k in cache if k not in digests]:
+            del cache[key]
 
-# メインダッシュボードの表示 (v1.0.0.py の main 関数を show_main_app にリネーム)
-def show_main_app():
-    # This style block should be removed or commented out as it might interfere with font settings
-    # st.markdown("""
-    # <style>
-    # @font-face {
-    # font-family: 'Noto Sans JP';
-    # src: url('/static/NotoSansJP-Thin.woff2') format('woff2');
-    # }
-    # body, div, p, span, input, label {
-    # font-family: 'Noto Sans JP', sans-serif !important;
-    # }
-    # </style>
-    # """, unsafe_allow_html=True)
+    @staticmethod
+    def warn_coerced_dates(entry):
+        if entry['rows'] == 0 or entry['coerced_dates'] == 0:
+            return
+        newly_coerced_nan_percentage = entry['coerced_dates'] / entry['rows'] * 100
+        if newly_coerced_nan_percentage > 10: # 例えば10%以上の値が無効になった場合に警告
+            st.warning(get_localized_text(
+                f"「実施日」列の{newly_coerced_nan_percentage:.1f}%が日付として認識できませんでした。元のデータ形式を確認してください。"
+            ))
 
-    st.title(get_localized_text("VRイベント分析アプリ"))
+    @staticmethod
+    def build_slot_bridge(df):
+        # イベント（行）→ 時間帯スロットの対応表を作る
+        # 行そのものは展開せず、スロット単位の集計だけがこの表を経由して結合する
+        if '時間帯' not in df.columns:
+            return None
+        slots = df['時間帯'].dropna().astype(str).str.split('・').explode().str.strip()
+        slots = slots[slots != '']
+        return pd.DataFrame({
+            'event': slots.index.to_numpy(),
+            '時間帯スロット': slots.to_numpy(dtype=object)
+        })
 
-    SessionManager.initialize()
+    @staticmethod
+    def slot_view(df, bridge):
+        # スロット単位の集計用ビュー: 対象イベントの行をブリッジ経由でスロットごとに取り出す
+        # インデックスは元のイベントのラベルのまま（同じイベントが複数のスロットに現れる）
+        positions = df.index.get_indexer(bridge['event'])
+        matched = positions >= 0
+        view = df.take(positions[matched])
+        view['時間帯スロット'] = bridge['時間帯スロット'].to_numpy()[matched]
+        return view
 
-    with st.sidebar:
-        st.markdown(get_localized_text("## 🔍 フィルター設定"))
-        st.markdown("---")
+    @staticmethod
+    def with_slots(df, columns):
+        # 選択された列に「時間帯スロット」が含まれる場合だけスロット単位のビューに切り替える
+        # それ以外の集計はイベント単位の行のまま行い、スロット数による重複カウントを避ける
+        bridge = st.session_state.get('slot_bridge')
+        if '時間帯スロット' in columns and '時間帯スロット' not in df.columns and bridge is not None:
+            return DataProcessor.slot_view(df, bridge)
+        return df
 
-        dfmain_for_sidebar = st.session_state.get('dfmain')
+    @staticmethod
+    def grouping_columns(df):
+        # グループ化に使える列（ブリッジがあれば「時間帯スロット」も選べる）
+        columns = DataSchema.category_columns(df)
+        if st.session_state.get('slot_bridge') is not None and '時間帯スロット' not in columns:
+            columns.append('時間帯スロット')
+        return columns
 
-        if dfmain_for_sidebar is not None and not dfmain_for_sidebar.empty:
-            df_filtered = dfmain_for_sidebar.copy()
+    @staticmethod
+    def column_kinds(df):
+        # 行ハッシュを計算するときに型を揃えるための列の種類
+        kinds = {}
+        for col in df.columns:
+            if pd.api.types.is_bool_dtype(df[col]):
+                kinds[col] = 'object'
+            elif pd.api.types.is_numeric_dtype(df[col]):
+                kinds[col] = 'numeric'
+            elif pd.api.types.is_datetime64_any_dtype(df[col]):
+                kinds[col] = 'datetime'
+            else:
+                kinds[col] = 'object'
+        return kinds
 
-            if '担当チーム' in df_filtered.columns:
-                teams = sorted(df_filtered['担当チーム'].dropna().unique())
-                
-                # selected_teams の初期値をセッションステートから取得、なければ全選択
-                initial_selected_teams = st.session_state.get('selected_teams')
-                # selected_teams がNoneの場合、全チームを選択状態にする
-                if initial_selected_teams is None:
-                    initial_selected_teams = teams
-                
-                selected_teams = st.multiselect(
-                    get_localized_text("👥 担当チーム"), 
-                    teams, 
-                    default=[t for t in initial_selected_teams if t in teams] # 存在しないチームがdefaultに含まれないようにフィルタ
-                )
-                st.session_state.selected_teams = selected_teams # セッションステートに選択を保存
+    @staticmethod
+    def row_hashes(df, kinds):
+        # 全列の内容から行ごとの64bitハッシュを計算する（drop_duplicates と同じく全列一致を重複とみなす）
+        # ファイルごとの型の違い（int64 と float64 など）でハッシュが変わらないよう列の種類ごとに型を揃える
+        # 既存データと型の種類が合わない列がある場合は None を返す
+        normalized = {}
+        for col, kind in kinds.items():
+            values = df[col]
+            if kind == 'numeric':
+                if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+                    return None
+                values = values.astype('float64')
+            elif kind == 'datetime':
+                if not pd.api.types.is_datetime64_any_dtype(values):
+                    return None
+            else:
+                values = values.astype(object)
+            normalized[col] = values
+        return pd.util.hash_pandas_object(pd.DataFrame(normalized, copy=False), index=False).to_numpy()
 
-                # 担当チームが何も選択されていない場合の動作変更
-                if len(selected_teams) == 0:
-                    st.warning(get_localized_text("担当チームが選択されていません。全ての担当チームのデータが表示されます。"))
-                    # df_filtered はこのブロックに入る前の状態（dfmain_for_sidebar）のまま使用
-                else:
-                    df_filtered = df_filtered[df_filtered['担当チーム'].isin(selected_teams)]
-
-            if '実施日' in df_filtered.columns:
-                # dt.dateに変換されているため、そのまま使用
-                valid_dates = df_filtered['実施日'].dropna()
-                if not valid_dates.empty:
-                    # Pythonのdateオブジェクトはmin()/max()で直接比較可能
-                    min_date = min(valid_dates)
-                    max_date = max(valid_dates)
-                    
-                    default_date_range = [min_date, max_date] if min_date <= max_date else [min_date, min_date]
-                    date_range = st.date_input(get_localized_text("📅 実施日の範囲"), value=default_date_range)
-                    
-                    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
-                        start, end = date_range[0], date_range[1]
-                        df_filtered = df_filtered[
-                            (df_filtered['実施日'] >= start) & 
-                            (df_filtered['実施日'] <= end)
-                        ]
-                else:
-                    st.warning(get_localized_text("日付データがありません。"))
-            
-            st.session_state.current_data = df_filtered
+    @staticmethod
+    def combine_frames(frames):
+        # 全ファイルを結合し、行ハッシュで重複を除いてから時間帯スロットの対応表を作る
+        # 戻り値はセッションステートにそのまま格納するキーと値
+        df = pd.concat(frames, ignore_index=True)
+        kinds = DataProcessor.column_kinds(df)
+        hashes = DataProcessor.row_hashes(df, kinds)
+        unique = ~pd.Series(hashes).duplicated().to_numpy()
+        df = df[unique].reset_index(drop=True)
+        df = DataSchema.apply(df)
+        bridge = DataProcessor.build_slot_bridge(df)
+        if bridge is not None:
+            bridge = DataSchema.apply(bridge)
+        return {
+            'dfmain': df,
+            'row_hashes': np.sort(hashes[unique]),
+            'column_kinds': kinds,
+            'slot_bridge': bridge,
+            'heatmap_store': HeatmapStore.build(df, bridge),
+            'column_profile': None
+        }
 
-        else:
-            st.info(get_localized_text("データをアップロードしてください"))
+    @staticmethod
+    def append_frames(dfmain, sorted_hashes, kinds, bridge, store, frames):
+        # 追加されたファイルだけを処理し、既存データとの重複をハッシュで除いて末尾に追加する
+        # 列構成や型が既存データと合わない場合は None を返す（全体の再構築が必要）
+        new = pd.concat(frames, ignore_index=True)
+        if set(new.columns) != set(kinds):
+            return None
+        hashes = DataProcessor.row_hashes(new, kinds)
+        if hashes is None:
+            return None
 
-    tabs = st.tabs([
-        get_localized_text("📊 データ管理"),
-        get_localized_text("📈 分析・比較"),
-        get_localized_text("📊 クロス集計"),
-        get_localized_text("🕒 ヒートマップ"),
-        get_localized_text("📉 時系列"),
-        get_localized_text("🏆 ランキング"),
-        get_localized_text("📋 自動レポート")
-    ])
+        if len(sorted_hashes) > 0:
+            pos = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+            known = sorted_hashes[pos] == hashes
+        else:
+            known = np.zeros(len(hashes), dtype=bool)
+        keep = ~known & ~pd.Series(hashes).duplicated().to_numpy()
+        new = new[keep]
+        new.index = pd.RangeIndex(len(dfmain), len(dfmain) + len(new))
+
+        new_hashes = np.sort(hashes[keep])
+        merged_hashes = np.insert(sorted_hashes, np.searchsorted(sorted_hashes, new_hashes), new_hashes)
+
+        # 時間帯スロットの対応表とヒートマップのストアも追加分だけを作って足し合わせる
+        added_bridge = DataProcessor.build_slot_bridge(new)
+        new_store = HeatmapStore.combine(store, HeatmapStore.build(new, added_bridge))
+        new_bridge = added_bridge
+        if bridge is not None and added_bridge is not None:
+            new_bridge = DataSchema.concat(bridge, added_bridge)
+        # 四分位数やユニーク値数は足し合わせられないので、プロファイルは次に使うときに結合後のデータで作る
+        return {
+            'dfmain': DataSchema.concat(dfmain, new),
+            'row_hashes': merged_hashes,
+            'column_kinds': kinds,
+            'slot_bridge': new_bridge,
+            'heatmap_store': new_store,
+            'column_profile': None
+        }
 
-    title_font = {
-        'fontsize': 14,
-        'fontweight': 'bold'
-    }
+class DataSchema:
+    # 曜日は月〜日の順に並べる
+    WEEKDAYS = ['月', '火', '水', '木', '金', '土', '日']
+    # 常にカテゴリ型で保持する列
+    CATEGORY_COLUMNS = ['担当チーム', '曜日', '時間帯', '時間帯スロット']
+    # その他の文字列列は、ユニーク値の割合がこの値以下ならカテゴリ型にする
+    CATEGORY_MAX_UNIQUE_RATIO = 0.5
 
-    with tabs[0]:
-        st.header(get_localized_text("📁 分析対象CSVファイルのアップロード"))
-        
-        col1, col2 = st.columns([2, 1])
-        with col1:
-            all_uploaded_files_current_run = [] 
-            uploader_objects = [] 
-            last_uploaded_idx = -1 
-
-            for i in range(st.session_state.num_uploaders):
-                label = get_localized_text("CSVファイル (必須)") if i == 0 else get_localized_text(f"追加のCSVファイル (オプション {i})")
-                file_obj = st.file_uploader(
-                    label,
-                    type="csv",
-                    key=f"csv_upload_{i}"
-                )
-                uploader_objects.append(file_obj)
-                
-                if file_obj is not None:
-                    last_uploaded_idx = i
-                    all_uploaded_files_current_run.append(file_obj)
+    @staticmethod
+    def category_columns(df):
+        # 分析・集計でカテゴリとして扱う列（文字列列とカテゴリ型の列）
+        # pandas 3 以降は文字列列が str 型になるので 'string' も指定する
+        return df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
 
-            new_num_uploaders = st.session_state.num_uploaders
+    @staticmethod
+    def category_dtype(col, values):
+        # カテゴリの並びは値の順（曜日は月〜日）で固定し、追加データでも順番が変わらないようにする
+        observed = sorted(pd.unique(values.dropna()), key=str)
+        if col == '曜日':
+            extra = [v for v in observed if v not in DataSchema.WEEKDAYS]
+            return pd.CategoricalDtype(DataSchema.WEEKDAYS + extra, ordered=True)
+        return pd.CategoricalDtype(observed)
 
-            if last_uploaded_idx != -1:
-                target_num_uploaders = last_uploaded_idx + 2
-                new_num_uploaders = max(new_num_uploaders, target_num_uploaders)
-            else:
-                new_num_uploaders = 1
-            
-            if last_uploaded_idx != -1 and st.session_state.num_uploaders > (last_uploaded_idx + 2):
-                new_num_uploaders = last_uploaded_idx + 2
-            elif last_uploaded_idx == -1 and st.session_state.num_uploaders > 1:
-                new_num_uploaders = 1
-
-            if new_num_uploaders != st.session_state.num_uploaders:
-                st.session_state.num_uploaders = new_num_uploaders
-                st.rerun()
-
-            current_files_hash = hash(tuple((f.name, f.size) for f in all_uploaded_files_current_run if f is not None))
-            previous_files_hash = st.session_state.get('previous_files_hash', None)
-
-            files_changed = (current_files_hash != previous_files_hash)
-            
-            if files_changed and all_uploaded_files_current_run:
-                st.session_state.upload_files = all_uploaded_files_current_run
-                st.session_state.uploaded_file_processed = False
-                st.session_state.previous_files_hash = current_files_hash
-                st.rerun()
-
-            if st.session_state.upload_files and not st.session_state.uploaded_file_processed:
-                uploaded_dfs_temp = []
-                for f in st.session_state.upload_files:
-                    f.seek(0)
-                    df_t, error = DataProcessor.safe_read_csv(f)
-                    if error:
-                        st.error(get_localized_text(f"ファイル {f.name}: {error}"))
-                    else:
-                        df_t = DataProcessor.process_dataframe(df_t)
-                        if df_t is not None:
-                            uploaded_dfs_temp.append(df_t)
-
-                if uploaded_dfs_temp:
-                    df_combined = pd.concat(uploaded_dfs_temp, ignore_index=True).drop_duplicates()
-                    df_combined = DataProcessor.expand_time_slots(df_combined)
-                    st.session_state['dfmain'] = df_combined
-                    st.session_state.current_data = df_combined
-                    st.session_state.uploaded_file_processed = True
-
-                    numeric_cols_for_check = ['申込数', '参加者数', 'リアクション数', '宣伝回数', '満足回答']
-                    high_nan_cols = []
-                    for col in numeric_cols_for_check:
-                        if col in df_combined.columns:
-                            nan_percentage = df_combined[col].isnull().sum() / len(df_combined) * 100
-                            if nan_percentage > 50: 
-                                high_nan_cols.append(f"{col} ({nan_percentage:.1f}%)")
-                    if high_nan_cols:
-                        st.warning(get_localized_text(
-                            f"以下の数値列で高い欠損率が検出されました: {', '.join(high_nan_cols)}。\n"
-                            "これは、元のCSVファイルの該当列に数値以外のデータが多く含まれている可能性があります。"
-                            "データの正確性を確認してください。"
-                        ))
-                else:
-                    st.session_state['dfmain'] = None
-                    st.session_state.current_data = None
-                    st.session_state.uploaded_file_processed = True
-            
-        df_display = st.session_state.get('current_data')
-        if df_display is None or df_display.empty:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。"))
-        else:
-            if st.session_state.upload_files:
-                with col2:
-                    st.markdown(get_localized_text("### 📊 ファイル情報"))
-                    for i, f in enumerate(all_uploaded_files_current_run, 1):
-                        if f is not None:
-                            display_name = f.name if hasattr(f, 'name') else get_localized_text(f"ファイル {i}")
-                            st.info(get_localized_text(f"ファイル {i}: {display_name}"))
+    @staticmethod
+    def category_candidates(df):
+        # カテゴリ型にする文字列列（pandas 3 以降の str 型も含め、すでにカテゴリ型の列は除く）
+        columns = []
+        for col in df.columns:
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                continue
+            if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+                continue
+            if col in DataSchema.CATEGORY_COLUMNS:
+                columns.append(col)
+            elif df[col].nunique() <= len(df) * DataSchema.CATEGORY_MAX_UNIQUE_RATIO:
+                columns.append(col)
+        return columns
 
-                if len(st.session_state.upload_files) > 1: 
-                    st.markdown(get_localized_text("### 🔄 データ統合結果"))
-                    total_rows_before = 0
-                    for f in st.session_state.upload_files:
-                        f.seek(0)
-                        temp_df, _ = DataProcessor.safe_read_csv(f)
-                        if temp_df is not None:
-                            total_rows_before += len(temp_df)
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric(get_localized_text("アップロードされた全てのデータ数"), f"{total_rows_before}{get_localized_text('行')}")
-                    with col2:
-                        st.metric(get_localized_text("統合後のデータ数"), f"{len(df_display)}{get_localized_text('行')}")
-                    with col3:
-                        removed_rows = total_rows_before - len(df_display)
-                        if removed_rows > 0:
-                            st.metric(get_localized_text("重複削除"), f"{removed_rows}{get_localized_text('行')}")
-                            st.info(get_localized_text(
-                                f"※ {removed_rows}行の重複（全ての列が完全に一致する行）を削除しました。"
-                            ))
-                else:
-                    st.info(get_localized_text(f"単一ファイル（{len(df_display)}行）を処理します"))
-
-            st.markdown(get_localized_text("### 📋 データプレビュー"))
-            preview_rows = st.number_input(
-                get_localized_text("表示する行数（0で全行表示）"),
-                min_value=0,
-                max_value=len(df_display),
-                value=5
-            )
-            
-            if preview_rows == 0:
-                st.dataframe(df_display, use_container_width=True)
-            else:
-                st.dataframe(df_display.head(preview_rows), use_container_width=True)
-
-            st.markdown(get_localized_text("### 📋 列情報"))
-            col_info = pd.DataFrame({
-                get_localized_text('データ型'): df_display.dtypes,
-                get_localized_text('欠損値数'): df_display.isnull().sum(),
-                get_localized_text('欠損率(%)'): (df_display.isnull().sum() / len(df_display) * 100).round(2),
-                get_localized_text('ユニーク値数'): df_display.nunique(),
-            })
-            st.dataframe(col_info)
-
-            st.markdown(get_localized_text("### 📊 基本統計量"))
-            numeric_cols = df_display.select_dtypes(include=['int64', 'float64']).columns
-            if not numeric_cols.empty:
-                stats_df = df_display[numeric_cols].describe().T
-
-                rename_map = {
-                    "count": get_localized_text("データ数"),
-                    "mean": get_localized_text("平均"),
-                    "std": get_localized_text("標準偏差"),
-                    "min": get_localized_text("最小値"),
-                    "25%": "25%",
-                    "50%": get_localized_text("中央値"),
-                    "75%": "75%",
-                    "max": get_localized_text("最大値")
-                }
+    @staticmethod
+    def downcast_integers(df):
+        # 欠損のない整数列は値が収まる最小の整数型にする（浮動小数点列は精度を保つため float64 のまま）
+        for col in df.select_dtypes(include='integer').columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        return df
 
-                stats_df = stats_df.rename(columns=rename_map)
-                st.dataframe(stats_df)
+    @staticmethod
+    def apply(df):
+        # 結合後のデータを省メモリな型に揃える
+        for col in DataSchema.category_candidates(df):
+            df[col] = df[col].astype(DataSchema.category_dtype(col, df[col]))
+        return DataSchema.downcast_integers(df)
 
+    @staticmethod
+    def concat(existing, new):
+        # スキーマ適用済みのデータに追加分を結合する
+        # カテゴリ列は両方のカテゴリを合わせた型に揃えてから結合し、object 型に戻らないようにする
+        existing = existing.copy(deep=False)
+        new = DataSchema.downcast_integers(new)
+        for col in existing.columns:
+            if not isinstance(existing[col].dtype, pd.CategoricalDtype) or col not in new.columns:
+                continue
+            values = pd.Series(list(existing[col].cat.categories) + list(pd.unique(new[col].dropna())))
+            dtype = DataSchema.category_dtype(col, values)
+            if dtype != existing[col].dtype:
+                existing[col] = existing[col].cat.set_categories(dtype.categories, ordered=dtype.ordered)
+            new[col] = new[col].astype(dtype)
+        return pd.concat([existing, new], ignore_index=True)
+
+
+class ColumnProfiler:
+    # 列情報に表示する上位カテゴリの数
+    TOP_CATEGORIES = 3
+    # 基本統計量に表示する分位点（describe() と同じ）
+    QUANTILES = [0.25, 0.5, 0.75]
 
-            st.markdown(get_localized_text("### 📊 カテゴリ列の内訳"))
-            category_cols = df_display.select_dtypes(include=['object']).columns
-            if not category_cols.empty:
-                selected_col = st.selectbox(get_localized_text("確認する列を選択"), category_cols)
-                value_counts = df_display[selected_col].value_counts()
+    @staticmethod
+    def numeric_summary(df, columns):
+        # 数値列をまとめて一度だけ列ごとに並べ替え、describe() の統計量とユニーク値数を求める
+        # 欠損値は並べ替えると末尾に集まるので、先頭から件数分が有効な値になる
+        values = np.sort(df[columns].to_numpy(dtype=np.float64, na_value=np.nan), axis=0)
+        if len(values) == 0:
+            values = np.full((1, len(columns)), np.nan)
+        count = np.count_nonzero(~np.isnan(values), axis=0)
+        valid = np.arange(len(values))[:, None] < count
+        positions = np.arange(len(columns))
+        last = np.maximum(count - 1, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(valid, values, 0).sum(axis=0) / count
+            squares = (np.where(valid, values - mean, 0) ** 2).sum(axis=0)
+            std = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+        # 隣り合う値を直接比べる（inf - inf は NaN になるので差分では数えられない）
+        changes = (values[1:] != values[:-1]) & valid[1:]
+        summary = {
+            'count': count,
+            'mean': mean,
+            'std': std,
+            'min': values[0]
+        }
+        for q in ColumnProfiler.QUANTILES:
+            # describe() と同じ線形補間
+            pos = q * last
+            low = np.floor(pos).astype(np.int64)
+            high = np.minimum(low + 1, last)
+            summary[f"{q:.0%}"] = values[low, positions] + (values[high, positions] - values[low, positions]) * (pos - low)
+        summary['max'] = values[last, positions]
+        distinct = np.where(count > 0, changes.sum(axis=0) + 1, 0)
+        return pd.DataFrame(summary, index=columns), pd.Series(distinct, index=columns)
 
-                fig, ax = plt.subplots()
-                sns.countplot(x=selected_col, data=df_filtered, order=df_filtered[selected_col].value_counts().index, ax=ax)
+    @staticmethod
+    def category_counts(series):
+        # 値ごとの件数（多い順）。カテゴリ型はコードの bincount で数える
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            counts = pd.Series(
+                np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)),
+                index=series.cat.categories,
+                name='count'
+            )
+            return counts[counts > 0].sort_values(ascending=False, kind='stable')
+        return series.value_counts()
 
-                # 🔽 x軸のラベルタイトルに日本語フォントを適用（これがないと豆腐になる）
-                ax.set_xlabel(get_graph_text(str(selected_col)), fontproperties=font_prop)
+    @staticmethod
+    def build(df):
+        # 全列のプロファイル（型・欠損値数・ユニーク値数・基本統計量・カテゴリごとの件数）をまとめて作る
+        numeric = df.select_dtypes(include='number').columns.tolist()
+        categorical = DataSchema.category_columns(df)
+        non_null = {}
+        distinct = {}
+        counts = {}
+        stats = pd.DataFrame()
+        if numeric:
+            stats, numeric_distinct = ColumnProfiler.numeric_summary(df, numeric)
+            non_null.update(stats['count'])
+            distinct.update(numeric_distinct)
+        for col in categorical:
+            counts[col] = ColumnProfiler.category_counts(df[col])
+            non_null[col] = int(counts[col].sum())
+            distinct[col] = len(counts[col])
+        for col in df.columns:
+            if col not in non_null:
+                non_null[col] = int(df[col].count())
+                distinct[col] = int(df[col].nunique())
+
+        nulls = len(df) - pd.Series(non_null).reindex(df.columns)
+        top = {
+            col: ', '.join(f"{value} ({n})" for value, n in col_counts.head(ColumnProfiler.TOP_CATEGORIES).items())
+            for col, col_counts in counts.items()
+        }
+        columns = pd.DataFrame({
+            'dtype': df.dtypes,
+            'nulls': nulls,
+            'null_rate': (nulls / max(len(df), 1) * 100).round(2),
+            'distinct': pd.Series(distinct).reindex(df.columns),
+            'top': pd.Series(top, dtype=object).reindex(df.columns)
+        })
+        return {'rows': len(df), 'columns': columns, 'numeric': stats, 'counts': counts}
 
-                # 描画（tickが作られた後）を強制実行
-                plt.draw()
+    @staticmethod
+    def for_view(df):
+        # 全体のプロファイルはデータセットごとに最初に使うときに一度だけ作り、絞り込み中は条件ごとに一度だけ作る
+        if df is st.session_state.dfmain:
+            if st.session_state.column_profile is None:
+                st.session_state.column_profile = ColumnProfiler.build(df)
+            return st.session_state.column_profile
+        return ResultCache.get_or_compute('data', 'profile', lambda: ColumnProfiler.build(df))
 
-                # x軸ラベルにフォントを個別に適用
-                for label in ax.get_xticklabels():
-                    label.set_fontproperties(font_prop)
 
-                # 念のため tight_layout
-                plt.tight_layout()
+class HeatmapStore:
+    # ストアに保持する配列（指標 × 曜日 × 時間帯スロット）
+    ARRAYS = ['sum', 'count', 'sumsq']
 
-                st.pyplot(fig)
+    @staticmethod
+    def build(df, bridge):
+        # 行データから 曜日 × 時間帯スロット ごとの合計・件数・二乗和を求める（O(行数)）
+        if bridge is None or '曜日' not in df.columns:
+            return None
+        metrics = df.select_dtypes(include='number').columns.tolist()
+        view = DataProcessor.slot_view(DatasetView.project(df, ['曜日'] + metrics), bridge)
+        slots = sorted(pd.unique(view['時間帯スロット'].dropna()), key=str)
+        days = pd.Categorical(view['曜日'], categories=DataSchema.WEEKDAYS).codes.astype(np.int64)
+        slot_codes = pd.Categorical(view['時間帯スロット'], categories=slots).codes.astype(np.int64)
+        cells = days * len(slots) + slot_codes
+        in_grid = (days >= 0) & (slot_codes >= 0)
+
+        grid = (len(DataSchema.WEEKDAYS), len(slots))
+        size = grid[0] * grid[1]
+        store = {
+            'metrics': metrics,
+            'slots': slots,
+            'sum': np.zeros((len(metrics),) + grid),
+            'count': np.zeros((len(metrics),) + grid, dtype=np.int64),
+            'sumsq': np.zeros((len(metrics),) + grid)
+        }
+        for i, metric in enumerate(metrics):
+            values = view[metric].to_numpy(dtype=float, na_value=np.nan)
+            valid = in_grid & ~np.isnan(values)
+            idx, values = cells[valid], values[valid]
+            store['sum'][i] = np.bincount(idx, weights=values, minlength=size).reshape(grid)
+            store['count'][i] = np.bincount(idx, minlength=size).reshape(grid)
+            store['sumsq'][i] = np.bincount(idx, weights=values * values, minlength=size).reshape(grid)
+        return store
 
-                # ここから追加：tickラベルに日本語フォントを適用
-                plt.draw()
-                for label in ax.get_xticklabels():
-                    label.set_fontproperties(font_prop)
+    @staticmethod
+    def combine(a, b, sign=1):
+        # 2つのストアを足し合わせる（sign=-1 なら b を差し引く）。指標とスロットは和集合に揃える
+        if a is None or b is None:
+            return a if b is None else b
+        metrics = a['metrics'] + [m for m in b['metrics'] if m not in a['metrics']]
+        slots = sorted(set(a['slots']) | set(b['slots']), key=str)
+        metric_pos = {m: i for i, m in enumerate(metrics)}
+        slot_pos = {v: i for i, v in enumerate(slots)}
+        days = np.arange(len(DataSchema.WEEKDAYS))
+
+        result = {'metrics': metrics, 'slots': slots}
+        for key in HeatmapStore.ARRAYS:
+            merged = np.zeros((len(metrics), len(days), len(slots)), dtype=a[key].dtype)
+            for store, factor in ((a, 1), (b, sign)):
+                grid = np.ix_(
+                    [metric_pos[m] for m in store['metrics']],
+                    days,
+                    [slot_pos[v] for v in store['slots']]
+                )
+                merged[grid] += factor * store[key]
+            result[key] = merged
+        return result
 
-                # タイトル・軸ラベル
-                ax.set_title(get_graph_text(f"{selected_col}の値カウント"), fontproperties=font_prop, **title_font)
-                ax.set_xlabel(get_graph_text(str(selected_col)), fontproperties=font_prop)
-                ax.set_ylabel(get_graph_text("カウント"), fontproperties=font_prop)
+    @staticmethod
+    def for_view(df):
+        # 表示対象データのストア。フィルターなしなら全体のストアをそのまま使う
+        # フィルター時は除外された行の分を全体から差し引く（除外の方が多ければ対象行から作る）
+        full = st.session_state.heatmap_store
+        dfmain = st.session_state.get('dfmain')
+        if full is None or dfmain is None or df is dfmain:
+            return full
+        cached = st.session_state.heatmap_view
+        if cached.get('key') != st.session_state.filter_key:
+            bridge = st.session_state.slot_bridge
+            excluded = np.ones(len(dfmain), dtype=bool)
+            excluded[dfmain.index.get_indexer(df.index)] = False
+            if excluded.sum() < len(df):
+                store = HeatmapStore.combine(full, HeatmapStore.build(dfmain[excluded], bridge), sign=-1)
+            else:
+                store = HeatmapStore.build(df, bridge)
+            cached = {'key': st.session_state.filter_key, 'store': store}
+            st.session_state.heatmap_view = cached
+        return cached['store']
 
-                # ✅ x軸のTickラベルを完全に再描画する
-                xtick_labels = [tick.get_text() for tick in ax.get_xticklabels()]
+    @staticmethod
+    def pivot(store, metric, agg):
+        # ストアから 時間帯スロット × 曜日 の表を求める（O(セル数)）。データのない行・列は除く
+        i = store['metrics'].index(metric)
+        count = store['count'][i].T.astype(float)
+        total = store['sum'][i].T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if agg == 'mean':
+                values = total / count
+            elif agg == 'sum':
+                values = total
+            elif agg == 'count':
+                values = count
+            else:
+                # 標本標準偏差（二乗和から求める。丸め誤差で負にならないよう 0 で切る）
+                variance = np.maximum(store['sumsq'][i].T - total * total / count, 0) / (count - 1)
+                values = np.where(count > 1, np.sqrt(variance), np.nan)
+        present = count > 0
+        table = pd.DataFrame(
+            np.where(present, values, np.nan),
+            index=pd.Index(store['slots'], name='時間帯スロット'),
+            columns=pd.Index(DataSchema.WEEKDAYS, name='曜日')
+        )
+        return table.loc[present.any(axis=1), present.any(axis=0)]
+
+
+class FilterEngine:
+    # 保持するフィルター結果の件数
+    MAX_CACHED_RESULTS = 8
 
-                # y軸も念のため再設定（なくてもいいけど）
-                ytick_labels = [tick.get_text() for tick in ax.get_yticklabels()]
+    @staticmethod
+    def build_index(df):
+        # データのバージョンごとに一度だけ作る索引
+        # 実施日の昇順に並べた行番号と、担当チームごとの行ビットマップ（packbits で圧縮）
+        index = {'rows': len(df), 'date_order': None, 'sorted_dates': None, 'team_bitmaps': {}}
+        if '実施日' in df.columns:
+            dates = df['実施日'].to_numpy(dtype='datetime64[ns]')
+            valid_rows = np.flatnonzero(~np.isnat(dates))
+            order = valid_rows[np.argsort(dates[valid_rows], kind='stable')]
+            index['date_order'] = order
+            index['sorted_dates'] = dates[order]
+        if '担当チーム' in df.columns:
+            codes, teams = pd.factorize(df['担当チーム'], sort=True)
+            for code, team in enumerate(teams):
+                index['team_bitmaps'][team] = np.packbits(codes == code)
+        return index
 
-                # 表示
-                st.pyplot(fig)
+    @staticmethod
+    def get_index(df, version):
+        cached = st.session_state.get('filter_index')
+        if cached is None or cached[0] != version:
+            cached = (version, FilterEngine.build_index(df))
+            st.session_state.filter_index = cached
+            st.session_state.filter_cache = {}
+        return cached[1]
 
+    @staticmethod
+    def team_mask(index, teams):
+        # 選択されたチームのビットマップの論理和（未選択なら None = 全行）
+        if not teams:
+            return None
+        packed = np.zeros((index['rows'] + 7) // 8, dtype=np.uint8)
+        for team in teams:
+            bitmap = index['team_bitmaps'].get(team)
+            if bitmap is not None:
+                packed |= bitmap
+        return np.unpackbits(packed, count=index['rows']).astype(bool)
 
-                for label in ax.get_xticklabels():
-                    label.set_fontproperties(font_prop)
-                for label in ax.get_yticklabels():
-                    label.set_fontproperties(font_prop)
-                
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-                st.pyplot(fig)
+    @staticmethod
+    def date_bounds(index, mask):
+        # マスク内の行の最小・最大の実施日（日付順の索引を先頭・末尾から探す）
+        sorted_dates = index['sorted_dates']
+        if sorted_dates is None or len(sorted_dates) == 0:
+            return None
+        if mask is None:
+            return sorted_dates[0], sorted_dates[-1]
+        selected = mask[index['date_order']]
+        if not selected.any():
+            return None
+        first = np.argmax(selected)
+        last = len(selected) - 1 - np.argmax(selected[::-1])
+        return sorted_dates[first], sorted_dates[last]
 
-    with tabs[1]:
-        st.header(get_localized_text("📈 分析・比較"))
-        
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                num_cols = df.select_dtypes(include='number').columns.tolist()
-                cat_cols = df.select_dtypes(include='object').columns.tolist()
-                
-                if not num_cols:
-                    st.warning(get_localized_text("数値列がありません。"))
-                    st.stop()
-                if not cat_cols:
-                    st.warning(get_localized_text("カテゴリ列がありません。"))
-                    st.stop()
+    @staticmethod
+    def date_mask(index, start, end):
+        # 日付順の索引を二分探索して範囲内の行だけを立てる
+        sorted_dates = index['sorted_dates']
+        lo = np.searchsorted(sorted_dates, np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+        hi = np.searchsorted(sorted_dates, np.datetime64(pd.Timestamp(end), 'ns'), side='right')
+        mask = np.zeros(index['rows'], dtype=bool)
+        mask[index['date_order'][lo:hi]] = True
+        return mask
 
-                target_num = st.selectbox(get_localized_text("分析対象（数値）"), num_cols)
-                group_col = st.selectbox(get_localized_text("グループ化（カテゴリ）"), cat_cols)
+    @staticmethod
+    def apply(df, version, teams, date_range):
+        # (データのバージョン, チーム, 日付範囲) ごとに結果をメモ化する
+        key = (version, tuple(teams or ()), tuple(date_range or ()))
+        cache = st.session_state.filter_cache
+        if key in cache:
+            return cache[key]
+
+        index = FilterEngine.get_index(df, version)
+        mask = FilterEngine.team_mask(index, teams)
+        if date_range and index['sorted_dates'] is not None:
+            dates = FilterEngine.date_mask(index, *date_range)
+            mask = dates if mask is None else mask & dates
+
+        # 絞り込みがない場合はコピーせずに元のデータをそのまま使う
+        if mask is None or mask.all():
+            result = df
+        else:
+            result = df.take(np.flatnonzero(mask))
 
-            with col2:
-                agg_options = [
-                    get_localized_text('平均'),
-                    get_localized_text('合計'),
-                    get_localized_text('中央値'),
-                    get_localized_text('最大'),
-                    get_localized_text('最小'),
-                    get_localized_text('データ数')
-                ]
-                selected_aggs_display = st.multiselect(
-                    get_localized_text("表示する統計指標"),
-                    agg_options,
-                    default=agg_options
-                )
-                exclude_outliers = st.checkbox(get_localized_text("外れ値を除外"))
+        if len(cache) >= FilterEngine.MAX_CACHED_RESULTS:
+            cache.pop(next(iter(cache)))
+        cache[key] = result
+        return result
 
-            try:
-                analysis_df = df.copy()
-                
-                if exclude_outliers and target_num in analysis_df.columns and analysis_df[target_num].std() > 0:
-                    z_scores = np.abs((analysis_df[target_num] - analysis_df[target_num].mean()) / 
-                                    analysis_df[target_num].std())
-                    analysis_df = analysis_df[z_scores < 3]
-                elif exclude_outliers: # std=0の場合
-                    st.info(get_localized_text(
-                        f"'{target_num}'のデータにばらつきがないため、外れ値除外は適用されませんでした。"
-                    ))
 
+class DatasetView:
+    @staticmethod
+    def current():
+        # 現在の表示対象データ（読み取り専用として共有し、コピーしない）
+        df = st.session_state.get('current_data')
+        if df is None or df.empty:
+            return None
+        return df
 
-                agg_map_internal = {
-                    get_localized_text('平均'): 'mean',
-                    get_localized_text('合計'): 'sum',
-                    get_localized_text('中央値'): 'median',
-                    get_localized_text('最大'): 'max',
-                    get_localized_text('最小'): 'min',
-                    get_localized_text('データ数'): 'count'
-                }
-                
-                agg_funcs_list = [agg_map_internal[a] for a in selected_aggs_display if a in agg_map_internal] 
+    @staticmethod
+    def project(df, columns):
+        # 画面で使う列だけを取り出す（存在しない列と重複は無視する）
+        selected = [c for c in dict.fromkeys(columns) if c in df.columns]
+        return df[selected]
 
-                if group_col in analysis_df.columns and target_num in analysis_df.columns:
-                    grouped_df = analysis_df.groupby(group_col)[target_num].agg(agg_funcs_list)
-                    
-                    # 存在するカラムのみリネーム
-                    rename_dict = {agg_map_internal[a]: f"{target_num}_{a}" for a in selected_aggs_display if agg_map_internal[a] in grouped_df.columns}
-                    grouped_df.rename(columns=rename_dict, inplace=True)
 
-                else:
-                    st.error(get_localized_text("選択された列がデータフレームに存在しません。"))
-                    grouped_df = pd.DataFrame()
-
-                if not grouped_df.empty:
-                    st.markdown(get_localized_text("### 📊 グループ別集計結果"))
-                    st.dataframe(grouped_df.round(2), use_container_width=True)
-
-                    if selected_aggs_display:
-                        st.markdown(get_localized_text("### 📈 統計指標別グラフ"))
-                        cols = st.columns(2)
-                        for i, metric_display_name in enumerate(selected_aggs_display):
-                            col_name_for_plot = f"{target_num}_{metric_display_name}" 
-                            if col_name_for_plot in grouped_df.columns:
-                                with cols[i % 2]:
-                                    fig, ax = plt.subplots(figsize=(8, 4))
-                                    # 🔽 これを追加（x軸のラベルに日本語フォントを適用）
-                                    plt.draw()
-                                    for label in ax.get_xticklabels():
-                                        label.set_fontproperties(font_prop)
-
-                                    grouped_df[col_name_for_plot].plot(kind='bar', ax=ax)
-                                    # Apply font_prop to title, labels, and ticks
-                                    ax.set_ylabel(get_graph_text(f"{target_num}の{metric_display_name}"), fontproperties=font_prop)
-                                    ax.set_xlabel(get_graph_text(group_col), fontproperties=font_prop)
-                                    ax.set_title(get_graph_text(f"{group_col}ごとの{target_num}（{metric_display_name}）"), fontproperties=font_prop)
-                                    for label in ax.get_xticklabels():
-                                        label.set_fontproperties(font_prop)
-                                    for label in ax.get_yticklabels():
-                                        label.set_fontproperties(font_prop)
-                                    plt.xticks(rotation=45)
-                                    plt.tight_layout()
-                                    st.pyplot(fig)
-
-                                    buf = io.BytesIO()
-                                    fig.savefig(buf, format='png')
-                                    st.download_button(
-                                        get_localized_text(f"📥 {metric_display_name}のグラフを保存"),
-                                        buf.getvalue(),
-                                        f"analysis_{metric_display_name}.png",
-                                        "image/png"
-                                    )
-                else:
-                    st.warning(get_localized_text("集計結果がありません。フィルター設定またはデータを確認してください。"))
+class GroupCube:
+    # グループごとに保持する部分集計（平均は合計とデータ数から求める）
+    PARTIALS = ['count', 'sum', 'min', 'max', 'median']
 
-            except Exception as e:
-                st.error(get_localized_text(f"分析エラー: {e}"))
-        else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+    @staticmethod
+    def get(df, group_col):
+        # フィルター状態ごとのキューブから、グループ列の部分集計を返す（未計算なら作成する）
+        cube = st.session_state.group_cube
+        if cube.get('key') != st.session_state.filter_key:
+            cube = {'key': st.session_state.filter_key, 'groups': {}}
+            st.session_state.group_cube = cube
+        if group_col not in cube['groups']:
+            cube['groups'][group_col] = GroupCube.build(df, group_col)
+        return cube['groups'][group_col]
 
-    with tabs[2]:
-        st.header(get_localized_text("📊 クロス集計"))
+    @staticmethod
+    def build(df, group_col):
+        # すべての数値列の部分集計を1回のグループ化でまとめて求める
+        num_cols = df.select_dtypes(include='number').columns.tolist()
+        frame = DataProcessor.with_slots(DatasetView.project(df, num_cols + [group_col]), [group_col])
+        return frame.groupby(group_col, observed=True)[num_cols].agg(GroupCube.PARTIALS)
 
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
+    @staticmethod
+    def lookup(partials, target_num, funcs):
+        # キューブから指定された列・統計量を取り出す
+        target = partials[target_num]
+        columns = {}
+        for func in funcs:
+            if func == 'mean':
+                columns[func] = target['sum'] / target['count'].where(target['count'] > 0)
+            else:
+                columns[func] = target[func]
+        return pd.DataFrame(columns, index=target.index)
 
-            cat_cols = df.select_dtypes(include='object').columns.tolist()
-            num_cols = df.select_dtypes(include='number').columns.tolist()
 
-            if len(cat_cols) < 2:
-                st.warning(get_localized_text("クロス集計には2つ以上のカテゴリ列が必要です。"))
-                st.stop()
-            if not num_cols:
-                st.warning(get_localized_text("数値列がありません。"))
-                st.stop()
+class CrossTabEngine:
+    # 1回のグループ化で求める部分集計（平均は合計とデータ数から求める）
+    PARTIALS = ['count', 'sum', 'min', 'max', 'median']
 
-            col1 = st.selectbox(get_localized_text("行カテゴリ"), cat_cols, key="cross_row")
-            col2_options = [c for c in cat_cols if c != col1]
-            if not col2_options:
-                st.warning(get_localized_text(f"'{col1}' 以外のカテゴリ列がありません。"))
-                st.stop()
-            col2 = st.selectbox(get_localized_text("列カテゴリ"), col2_options, key="cross_col")
+    @staticmethod
+    def partials(df, value, levels):
+        # 指定した軸の組み合わせごとに、数値項目の部分集計をまとめて求める
+        frame = DataProcessor.with_slots(DatasetView.project(df, levels + [value]), levels)
+        return frame.groupby(levels, observed=True)[value].agg(CrossTabEngine.PARTIALS)
 
-            num_col = st.selectbox(get_localized_text("数値項目"), num_cols, key="cross_num")
-            agg_method_display = st.selectbox(get_localized_text("集計方法"), [
-                get_localized_text('平均'),
-                get_localized_text('合計'),
-                get_localized_text('中央値'),
-                get_localized_text('最大'),
-                get_localized_text('最小'),
-                get_localized_text('データ数')
-            ], key="cross_agg")
+    @staticmethod
+    def get_cube(df, row, col, value, outliers=None):
+        # (行, 列, 数値項目, 外れ値除外) ごとのキューブ。集計方法の切り替えやドリルアップでは元データを読み直さない
+        return ResultCache.get_or_compute(
+            'crosstab',
+            (row, col, value, outliers),
+            lambda: {'base': CrossTabEngine.partials(df, value, [row, col]), 'drill': {}}
+        )
 
-            if st.button(get_localized_text("クロス集計を実行"), key="cross_execute"):
-                try:
-                    agg_map_internal = {
-                        get_localized_text('平均'): 'mean',
-                        get_localized_text('合計'): 'sum',
-                        get_localized_text('中央値'): 'median',
-                        get_localized_text('最大'): 'max',
-                        get_localized_text('最小'): 'min',
-                        get_localized_text('データ数'): 'count'
-                    }
-
-                    if col1 in df.columns and col2 in df.columns and num_col in df.columns:
-                        cross_table = pd.pivot_table(
-                            df,
-                            values=num_col,
-                            index=col1,
-                            columns=col2,
-                            aggfunc=agg_map_internal[agg_method_display]
-                        )
-                        if isinstance(cross_table.columns, pd.MultiIndex):
-                            cross_table.columns = cross_table.columns.droplevel(0)
-
-                        st.dataframe(cross_table)
-
-                        fig, ax = plt.subplots(figsize=(10, 5))
-                        cross_table.plot(kind='bar', ax=ax)
-                        # Apply font_prop to title, labels, and ticks
-                        ax.set_ylabel(get_graph_text(num_col), fontproperties=font_prop) # Column name is fine
-                        ax.set_xlabel(get_graph_text(col1), fontproperties=font_prop)
-                        ax.set_title(get_graph_text(f"{col1} × {col2} の {agg_method_display}"), fontproperties=font_prop)
-                        for label in ax.get_xticklabels():
-                            label.set_fontproperties(font_prop)
-                        for label in ax.get_yticklabels():
-                            label.set_fontproperties(font_prop)
-                        plt.xticks(rotation=45)
-                        plt.tight_layout()
-                        st.pyplot(fig)
-
-                        csv = cross_table.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
-                        st.download_button(
-                            get_localized_text("📥 クロス集計結果をCSVで保存"),
-                            csv,
-                            file_name="cross_table.csv",
-                            mime='text/csv',
-                            key="cross_download"
-                        )
-                    else:
-                        st.error(get_localized_text("選択された列がデータフレームに存在しません。"))
+    @staticmethod
+    def drill_down(df, cube, row, col, value, drill):
+        # 第3の軸で行を細分化した部分集計（軸ごとに一度だけ計算する）
+        if drill not in cube['drill']:
+            cube['drill'][drill] = CrossTabEngine.partials(df, value, [row, drill, col])
+        return cube['drill'][drill]
 
-                except Exception as e:
-                    st.error(get_localized_text(f"クロス集計の実行に失敗しました: {e}"))
+    @staticmethod
+    def table(partials, agg):
+        # 部分集計から指定された集計方法の表（列カテゴリを横に展開）を作る
+        if agg == 'mean':
+            values = partials['sum'] / partials['count'].where(partials['count'] > 0)
         else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+            values = partials[agg]
+        return values.unstack(partials.index.names[-1])
 
 
-    with tabs[3]:
-        st.header(get_localized_text("🟥 ヒートマップ"))
+class TrendEngine:
+    @staticmethod
+    def daily(df, metric, group):
+        # 日ごと（グループ指定時はグループごと）の合計・件数・行数を1回のグループ化で求める
+        # グループは列に展開し、以降の期間集計と移動平均は全グループまとめて行う
+        keys = ['実施日'] if group is None else ['実施日', group]
+        frame = DataProcessor.with_slots(DatasetView.project(df, keys + [metric]), keys)
+        daily = frame.groupby(keys, observed=True)[metric].agg(['sum', 'count', 'size'])
+        if group is None:
+            return {key: daily[[key]].set_axis([metric], axis=1) for key in ['sum', 'count', 'size']}
+        return {key: daily[key].unstack(group, fill_value=0) for key in ['sum', 'count', 'size']}
 
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
+    @staticmethod
+    def rollup(daily, rule):
+        # 日次の合計・件数を期間ごとに足し合わせて平均を求める
+        # inside は各グループの最初と最後のデータの間にある期間（グループごとの表示範囲）
+        sums = daily['sum'].resample(rule).sum()
+        counts = daily['count'].resample(rule).sum()
+        present = daily['size'].resample(rule).sum() > 0
+        inside = present.cummax() & present[::-1].cummax()[::-1]
+        return {'mean': (sums / counts.where(counts > 0)).where(inside), 'inside': inside}
 
-            df = DataProcessor.expand_time_slots(df)
+    @staticmethod
+    def get_rollup(df, metric, group, rule):
+        # 日次の部分集計と期間ごとの集計をそれぞれ保持し、集計期間の切り替えでは元データを読み直さない
+        daily = ResultCache.get_or_compute(
+            'trend', ('daily', metric, group), lambda: TrendEngine.daily(df, metric, group)
+        )
+        return ResultCache.get_or_compute(
+            'trend', ('rollup', metric, group, rule), lambda: TrendEngine.rollup(daily, rule)
+        )
 
-            if '時間帯スロット' not in df.columns or '曜日' not in df.columns:
-                st.warning(get_localized_text("ヒートマップを作成するには「時間帯」と「曜日」の列が必要です。"))
-                st.stop()
-            
-            if not all(col in df.columns for col in ['時間帯スロット', '曜日']):
-                st.warning(get_localized_text("ヒートマップの作成に必要な列（時間帯スロット、曜日）がデータに存在しません。"))
-                st.stop()
+    @staticmethod
+    def moving_average(rollup, window):
+        # 全グループの移動平均をまとめて求める（各グループの表示範囲外は NaN）
+        return rollup['mean'].rolling(window=window, min_periods=1).mean().where(rollup['inside'])
 
+    @staticmethod
+    def lttb(x, y, threshold):
+        # Largest-Triangle-Three-Buckets で threshold 点を選び、選んだ位置を返す（x は昇順、NaN なし）
+        # 両端の点は必ず残し、間の点を threshold - 2 個のバケットに分けて、
+        # 直前に選んだ点と次のバケットの平均点とで作る三角形の面積が最大の点を各バケットから1つ選ぶ
+        n = len(x)
+        every = (n - 2) / (threshold - 2)
+        edges = np.append((np.arange(threshold - 1) * every).astype(np.int64) + 1, n)
+        # 次のバケットの平均点は累積和からまとめて求める
+        sum_x = np.concatenate([[0.0], np.cumsum(x)])
+        sum_y = np.concatenate([[0.0], np.cumsum(y)])
+        sizes = edges[2:] - edges[1:-1]
+        next_x = (sum_x[edges[2:]] - sum_x[edges[1:-1]]) / sizes
+        next_y = (sum_y[edges[2:]] - sum_y[edges[1:-1]]) / sizes
+
+        selected = np.empty(threshold, dtype=np.int64)
+        selected[0] = 0
+        selected[-1] = n - 1
+        a = 0
+        for i in range(threshold - 2):
+            start, end = edges[i], edges[i + 1]
+            area = np.abs(
+                (x[a] - next_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y[i] - y[a])
+            )
+            a = start + int(np.argmax(area))
+            selected[i + 1] = a
+        return selected
 
-            numeric_cols = df.select_dtypes(include='number').columns.tolist()
-            if not numeric_cols:
-                st.warning(get_localized_text("数値列がありません。ヒートマップは数値データに基づいています。"))
-                st.stop()
+    @staticmethod
+    def downsample(series, width):
+        # 表示用に系列を横幅（ピクセル数）の点数まで間引く。点数が横幅以下ならそのまま返す
+        # 1ピクセルより広い欠損区間は先頭に NaN を残し、間引いた後も線が途切れるようにする
+        values = series.to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+        if len(valid) <= width or width < 3:
+            return series
+        keep = valid[TrendEngine.lttb(valid.astype(float), values[valid], width)]
+        gaps = valid[:-1][np.diff(valid) > len(values) / width] + 1
+        return series.iloc[np.union1d(keep, gaps)]
 
-            col1, col2 = st.columns(2)
-            with col1:
-                heat_metric = st.selectbox(
-                    get_localized_text("集計する指標"),
-                    numeric_cols,
-                    key="heat_metric"
-                )
-                agg_method_display = st.selectbox(
-                    get_localized_text("集計方法"),
-                    [get_localized_text('平均'), get_localized_text('合計'), get_localized_text('データ数')],
-                    key="heat_agg"
-                )
+    @staticmethod
+    def get_display_lines(lines, key, width):
+        # 描画用に間引いた系列（集計と移動平均の設定ごとに保持し、再実行のたびに間引き直さない）
+        return ResultCache.get_or_compute(
+            'trend', ('display', key, width), lambda: [TrendEngine.downsample(series, width) for series in lines]
+        )
 
-            with col2:
-                color_scale = st.selectbox(
-                    get_localized_text("カラースケール"),
-                    ['YlOrRd', 'viridis', 'coolwarm'],
-                    key="heat_color"
-                )
-                normalize = st.checkbox(get_localized_text("データを正規化"), value=True, key="heat_normalize")
 
-            if st.button(get_localized_text("ヒートマップを生成"), key="heat_execute"):
-                try:
-                    heat_df = df.copy()
-
-                    agg_map_internal = {
-                        get_localized_text('平均'): 'mean',
-                        get_localized_text('合計'): 'sum',
-                        get_localized_text('データ数'): 'count'
-                    }
-                    pivot_table = pd.pivot_table(
-                        heat_df,
-                        values=heat_metric,
-                        index='時間帯スロット',
-                        columns='曜日',
-                        aggfunc=agg_map_internal[agg_method_display]
-                        )
+class RankingService:
+    @staticmethod
+    def aggregates(df, group_col, metric, outliers=None):
+        # グループごとの平均値とデータ数（グループキューブから取り出し、元データは読み直さない）
+        # 外れ値を除く場合は、除外後の行で対象の指標だけを集計する
+        if outliers is None:
+            compute = lambda: GroupCube.lookup(GroupCube.get(df, group_col), metric, ['mean', 'count']).round(2)
+        else:
+            compute = lambda: GroupCube.lookup(
+                GroupCube.build(DatasetView.project(OutlierService.exclude(df, metric, outliers)[0], [metric, group_col]), group_col),
+                metric,
+                ['mean', 'count']
+            ).round(2)
+        return ResultCache.get_or_compute('ranking', (group_col, metric, outliers), compute)
 
-                    weekdays = ['月', '火', '水', '木', '金', '土', '日']
-                    existing_weekdays = [day for day in weekdays if day in pivot_table.columns]
-                    pivot_table = pivot_table.reindex(columns=existing_weekdays)
-                    
-                    try:
-                        pivot_table = pivot_table.reindex(sorted(pivot_table.index))
-                    except Exception:
-                        pass
-
-                    if normalize and not pivot_table.empty and pivot_table.std().std() > 0:
-                        pivot_table = (pivot_table - pivot_table.mean().mean()) / pivot_table.std().std()
-                    elif normalize and not pivot_table.empty: # 標準偏差が0の場合
-                        st.info(get_localized_text("データにばらつきがないため、ヒートマップの正規化はスキップされました。"))
-
-
-                    fig, ax = plt.subplots(figsize=(12, 8))
-                    sns.heatmap(
-                        pivot_table,
-                        cmap=color_scale,
-                        annot=True,
-                        fmt='.2f',
-                        linewidths=.5,
-                        linecolor='black',
-                        ax=ax
-                    )
+    @staticmethod
+    def eligible(aggregates, min_count):
+        # 順位を付ける対象（データ数が基準以上で、平均値があるグループ）
+        return aggregates[(aggregates['count'] >= min_count) & aggregates['mean'].notna()]
 
-                    # Apply font_prop to title, labels, and ticks
-                    ax.set_title(get_graph_text(f"時間帯×曜日の{heat_metric}（{agg_method_display}）"), fontproperties=font_prop, fontsize=16)
-                    ax.set_xlabel(get_graph_text(str("曜日")), fontproperties=font_prop, fontsize=12)
-                    ax.set_ylabel(get_graph_text("時間帯スロット"), fontproperties=font_prop, fontsize=12)
-                    ax.set_xticklabels(ax.get_xticklabels(), fontproperties=font_prop)
-                    ax.set_yticklabels(ax.get_yticklabels(), fontproperties=font_prop)
+    @staticmethod
+    def select(eligible, ascending, start, size):
+        # 順位 start+1 〜 start+size のグループを部分選択で取り出す（全体は並べ替えない）
+        # 同じ値は同じ順位とし、境界の同値は元の並び順で選ぶので、ページをまたいでも重複しない
+        keys = eligible['mean'].to_numpy(dtype=float)
+        if not ascending:
+            keys = -keys
+        k = min(start + size, len(keys))
+        if k <= start:
+            return eligible.iloc[:0].assign(rank=np.array([], dtype=np.int64))
+
+        kth = np.partition(keys, k - 1)[k - 1]
+        better = np.flatnonzero(keys < kth)
+        ties = np.flatnonzero(keys == kth)[:k - len(better)]
+        candidates = np.concatenate([better, ties])
+        order = candidates[np.lexsort((candidates, keys[candidates]))]
+
+        # 上位 k 件に入った値より良い値はすべて上位 k 件に含まれるので、同値の先頭位置がそのまま順位になる
+        sorted_keys = keys[order]
+        ranks = np.searchsorted(sorted_keys, sorted_keys, side='left') + 1
+        return eligible.iloc[order[start:]].assign(rank=ranks[start:])
+
+
+class OutlierService:
+    # 判定のしきい値（Zスコア、MAD によるロバストZスコア、四分位範囲の倍率）
+    Z_THRESHOLD = 3
+    MAD_THRESHOLD = 3.5
+    IQR_FACTOR = 1.5
+    # 正規分布のもとで MAD を標準偏差に換算する係数
+    MAD_SCALE = 1.4826
+    # 平均・分散をまとめて更新する行数
+    BLOCK_ROWS = 1 << 16
 
-                    for label in ax.get_xticklabels():
-                        label.set_fontproperties(font_prop)
-                    for label in ax.get_yticklabels():
-                        label.set_fontproperties(font_prop)
+    @staticmethod
+    def controls(key, group_col):
+        # 外れ値除外の設定欄。除外しない場合は None、除外する場合は (判定方法, グループ列または None)
+        if not st.checkbox(get_localized_text("外れ値を除外"), key=f"{key}_outliers"):
+            return None
+        modes = {
+            get_localized_text('Zスコア（平均±3σ）'): 'zscore',
+            get_localized_text('ロバスト（中央値±3.5MAD）'): 'mad',
+            get_localized_text('IQR（四分位範囲×1.5）'): 'iqr'
+        }
+        mode = st.selectbox(get_localized_text("外れ値の判定方法"), list(modes), key=f"{key}_outlier_mode")
+        per_group = False
+        # 時間帯スロットはイベントの行の属性ではないので、グループごとの判定は元の列だけで行う
+        if group_col in st.session_state.dfmain.columns:
+            per_group = st.checkbox(get_localized_text(f"「{group_col}」ごとに判定"), key=f"{key}_outlier_group")
+        return (modes[mode], group_col if per_group else None)
 
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    st.pyplot(fig)
+    @staticmethod
+    def moments(values, codes, n_groups):
+        # グループごとの平均と標準偏差。ブロックごとの件数・平均・偏差平方和を Chan の方法で合成する
+        # （Welford の逐次更新をブロック単位で行うので、大きな一時配列を作らず桁落ちもしにくい）
+        count = np.zeros(n_groups)
+        mean = np.zeros(n_groups)
+        m2 = np.zeros(n_groups)
+        for start in range(0, len(values), OutlierService.BLOCK_ROWS):
+            block = values[start:start + OutlierService.BLOCK_ROWS]
+            block_codes = codes[start:start + OutlierService.BLOCK_ROWS]
+            valid = ~np.isnan(block) & (block_codes >= 0)
+            block, block_codes = block[valid], block_codes[valid]
+            block_count = np.bincount(block_codes, minlength=n_groups).astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                block_mean = np.nan_to_num(np.bincount(block_codes, weights=block, minlength=n_groups) / block_count)
+                block_m2 = np.bincount(block_codes, weights=(block - block_mean[block_codes]) ** 2, minlength=n_groups)
+                total = count + block_count
+                delta = block_mean - mean
+                share = np.where(total > 0, block_count / total, 0)
+                mean = mean + delta * share
+                m2 = m2 + block_m2 + delta * delta * count * share
+            count = total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+        return np.where(count > 0, mean, np.nan), std
 
-                    csv = pivot_table.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
-                    st.download_button(
-                        get_localized_text("📥 ヒートマップデータをCSVで保存"),
-                        csv,
-                        file_name="heatmap_data.csv",
-                        mime='text/csv',
-                        key="heat_download"
-                    )
+    @staticmethod
+    def statistics(df, column, group_col):
+        # 列（とグループ列）ごとの平均・標準偏差・中央値・MAD・四分位数
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        if group_col is None:
+            codes, n_groups = np.zeros(len(df), dtype=np.int64), 1
+        else:
+            codes, labels = pd.factorize(df[group_col])
+            n_groups = len(labels)
+        mean, std = OutlierService.moments(values, codes, n_groups)
+
+        grouped = pd.Series(values[codes >= 0]).groupby(codes[codes >= 0])
+        quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack().reindex(range(n_groups))
+        median = quartiles[0.5].to_numpy()
+        deviations = np.abs(values - median[np.maximum(codes, 0)])[codes >= 0]
+        mad = pd.Series(deviations).groupby(codes[codes >= 0]).median().reindex(range(n_groups)).to_numpy()
+        return {
+            'values': values,
+            'codes': codes,
+            'mean': mean,
+            'std': std,
+            'median': median,
+            'mad': mad,
+            'q1': quartiles[0.25].to_numpy(),
+            'q3': quartiles[0.75].to_numpy()
+        }
 
-                    st.subheader(get_localized_text("📊 特徴的なパターン"))
+    @staticmethod
+    def flags(column, mode, group_col):
+        # データセット全体の行に対する外れ値フラグ。統計量は列ごと、フラグは判定方法ごとにデータのバージョンごとに一度だけ作る
+        store = st.session_state.outlier_store
+        if store.get('version') != st.session_state.dataset_version:
+            store = {'version': st.session_state.dataset_version, 'stats': {}, 'flags': {}}
+            st.session_state.outlier_store = store
+        key = (column, mode, group_col)
+        if key not in store['flags']:
+            if (column, group_col) not in store['stats']:
+                store['stats'][(column, group_col)] = OutlierService.statistics(st.session_state.dfmain, column, group_col)
+            stats = store['stats'][(column, group_col)]
+            values = stats['values']
+            codes = np.maximum(stats['codes'], 0)
+            with np.errstate(invalid='ignore'):
+                if mode == 'zscore':
+                    # 従来どおり |x - 平均| / 標準偏差 が 3 以上を外れ値とする
+                    scale = stats['std'][codes]
+                    flagged = (scale > 0) & (np.abs(values - stats['mean'][codes]) >= OutlierService.Z_THRESHOLD * scale)
+                elif mode == 'mad':
+                    scale = stats['mad'][codes] * OutlierService.MAD_SCALE
+                    flagged = (scale > 0) & (np.abs(values - stats['median'][codes]) > OutlierService.MAD_THRESHOLD * scale)
+                else:
+                    spread = (stats['q3'] - stats['q1'])[codes] * OutlierService.IQR_FACTOR
+                    flagged = (values < stats['q1'][codes] - spread) | (values > stats['q3'][codes] + spread)
+            store['flags'][key] = flagged & (stats['codes'] >= 0)
+        return store['flags'][key]
 
-                    if not pivot_table.empty:
-                        max_val_series = pivot_table.max()
-                        if not max_val_series.empty:
-                            max_val = max_val_series.max()
-                        else:
-                            max_val = np.nan
+    @staticmethod
+    def exclude(df, column, settings):
+        # 表示中のデータから外れ値の行を除く（フラグはデータセット全体の行番号で引き、外れ値がなければ元のデータを返す）
+        # 戻り値は (データ, 除外した行数)
+        if settings is None:
+            return df, 0
+        flagged = OutlierService.flags(column, *settings)[df.index.to_numpy()]
+        excluded = int(np.count_nonzero(flagged))
+        if excluded == 0:
+            return df, 0
+        return df.take(np.flatnonzero(~flagged)), excluded
+
+
+class CorrelationEngine:
+    # グループ別の相関行列を選べるグループ列の最大グループ数
+    MAX_GROUPS = 50
+    # 行列積をまとめて行う行数
+    BLOCK_ROWS = 1 << 16
 
-                        min_val_series = pivot_table.min()
-                        if not min_val_series.empty:
-                            min_val = min_val_series.min()
-                        else:
-                            min_val = np.nan
+    @staticmethod
+    def pairwise(values):
+        # 欠損値を含む列どうしの相関を、両方の列に有限の値がある行だけで求める（pandas の corr と同じ扱い）
+        # 率の列は分母が 0 だと ±inf になるので、NaN と同じく除く
+        # 件数・和・二乗和・積和を行列積で求めるので、列の組ごとにデータを走査しない
+        # 一時配列が大きくならないよう、行をブロックに分けて足し合わせる
+        k = values.shape[1]
+        blocks = range(0, len(values), CorrelationEngine.BLOCK_ROWS)
+        column_sums = np.zeros(k)
+        column_counts = np.zeros(k)
+        for start in blocks:
+            block = values[start:start + CorrelationEngine.BLOCK_ROWS]
+            finite = np.isfinite(block)
+            column_sums += np.where(finite, block, 0.0).sum(axis=0)
+            column_counts += np.count_nonzero(finite, axis=0)
+        # 桁落ちを防ぐため、列ごとの平均を引いてから和を求める
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.nan_to_num(column_sums / column_counts)
+
+        counts = np.zeros((k, k))
+        # sums[i, j] は列 j に値がある行での列 i の和（squares も同様）
+        sums = np.zeros((k, k))
+        squares = np.zeros((k, k))
+        products = np.zeros((k, k))
+        for start in blocks:
+            centered = values[start:start + CorrelationEngine.BLOCK_ROWS] - means
+            mask = np.isfinite(centered)
+            centered[~mask] = 0.0
+            mask = mask.astype(np.float64)
+            counts += mask.T @ mask
+            sums += centered.T @ mask
+            products += centered.T @ centered
+            np.square(centered, out=centered)
+            squares += centered.T @ mask
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = products - sums * sums.T / counts
+            var = squares - sums * sums / counts
+            denominator = np.sqrt(var * var.T)
+            corr = np.where((counts >= 2) & (denominator > 0), cov / denominator, np.nan)
+        return np.clip(corr, -1, 1), counts.astype(np.int64)
 
-                        if not np.isnan(max_val) and not pivot_table[pivot_table == max_val].empty:
-                            max_pos_df = pivot_table[pivot_table == max_val].stack().index[0]
-                            st.info(get_localized_text(
-                                f"🔺 最も{heat_metric}が高い時間帯: {max_pos_df[0]}の{max_pos_df[1]}曜日 ({max_val:.2f})"
-                            ))
-                        else:
-                            st.info(get_localized_text("🔺 最も高い値のパターンを特定できませんでした。"))
+    @staticmethod
+    def compute(df, method, group_col=None):
+        # 全数値列の相関行列。グループ列を指定すると、行をグループ順に一度だけ並べ替えてグループごとに求める
+        # スピアマンは列ごと（グループ別ならグループ内）の平均順位に対するピアソンの相関
+        columns = df.select_dtypes(include='number').columns.tolist()
+        frame = df[columns]
+        if method == 'spearman':
+            # 順位を付ける前に ±inf を欠損値にする（ピアソンと同じく相関の計算から除く）
+            frame = frame.mask(np.isinf(frame))
+        if group_col is None:
+            if method == 'spearman':
+                frame = frame.rank()
+            blocks = {None: frame.to_numpy(dtype=np.float64, na_value=np.nan)}
+        else:
+            codes, labels = pd.factorize(df[group_col], sort=True)
+            if method == 'spearman':
+                frame = frame.groupby(codes).rank()
+            values = frame.to_numpy(dtype=np.float64, na_value=np.nan)
+            order = np.argsort(codes, kind='stable')
+            sizes = np.bincount(codes[codes >= 0], minlength=len(labels))
+            start = np.count_nonzero(codes < 0)
+            bounds = start + np.cumsum(sizes)[:-1]
+            blocks = dict(zip(labels, np.split(values[order][start:], bounds - start)))
+
+        results = {}
+        for label, block in blocks.items():
+            corr, counts = CorrelationEngine.pairwise(block)
+            results[label] = {
+                'matrix': pd.DataFrame(corr, index=columns, columns=columns),
+                'counts': pd.DataFrame(counts, index=columns, columns=columns)
+            }
+        return results
 
-                        if not np.isnan(min_val) and not pivot_table[pivot_table == min_val].empty:
-                            min_pos_df = pivot_table[pivot_table == min_val].stack().index[0]
-                            st.info(get_localized_text(
-                                f"🔻 最も{heat_metric}が低い時間帯: {min_pos_df[0]}の{min_pos_df[1]}曜日 ({min_val:.2f})"
-                            ))
-                        else:
-                            st.info(get_localized_text("🔻 最も低い値のパターンを特定できませんでした。"))
-                    else:
-                        st.info(get_localized_text("ヒートマップデータが空のため、特徴的なパターンを特定できません。"))
+    @staticmethod
+    def get(df, method, group_col=None):
+        # 絞り込み条件ごとにキャッシュする
+        return ResultCache.get_or_compute('correlation', (method, group_col), lambda: CorrelationEngine.compute(df, method, group_col))
 
+    @staticmethod
+    def group_columns(df):
+        # グループ別の相関に使えるカテゴリ列（グループ数が多すぎる列は除く）
+        # 全列のプロファイルは作らず、カテゴリ列の値の種類数だけを数える（カテゴリ型は出現する値だけを数える）
+        return ResultCache.get_or_compute('correlation_groups', None, lambda: [
+            col for col in DataSchema.category_columns(df)
+            if 0 < df[col].nunique() <= CorrelationEngine.MAX_GROUPS
+        ])
 
-                except Exception as e:
-                    st.error(get_localized_text(f"ヒートマップ生成中にエラーが発生: {e}"))
-        else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+    @staticmethod
+    def strongest_pairs(matrix, top):
+        # 対角より上の組を、相関の絶対値が大きい順に並べる
+        upper = np.triu(np.ones(matrix.shape, dtype=bool), k=1)
+        pairs = matrix.where(upper).stack().rename('corr').reset_index()
+        pairs.columns = ['column_a', 'column_b', 'corr']
+        return pairs.reindex(pairs['corr'].abs().sort_values(ascending=False, kind='stable').index).head(top)
 
 
-    with tabs[4]:
-        st.header(get_localized_text("📉 時系列分析"))
+class ReportEngine:
+    # 上位表示するイベント数と、参加者数が少ない曜日の表示数
+    TOP_EVENTS = 5
+    LOW_WEEKDAYS = 3
 
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
+    @staticmethod
+    def with_rates(df):
+        # レポートで使う列だけを取り出し、率の列がなければ作る
+        frame = DatasetView.project(df, ['イベント名', '曜日', '時間帯', '申込数', '参加者数', 'リアクション数', '宣伝回数', '満足回答', '参加率(%)', '満足率(%)', 'リアクション率'])
+        if '参加率(%)' not in frame.columns and '申込数' in frame.columns and '参加者数' in frame.columns:
+            frame['参加率(%)'] = (frame['参加者数'] / frame['申込数']) * 100
+        if '満足率(%)' not in frame.columns and '満足回答' in frame.columns and '参加者数' in frame.columns:
+            frame['満足率(%)'] = (frame['満足回答'] / frame['参加者数']) * 100
+        if 'リアクション率' not in frame.columns and 'リアクション数' in frame.columns and '参加者数' in frame.columns:
+            frame['リアクション率'] = frame['リアクション数'] / frame['参加者数']
+        return frame
 
-            if '実施日' not in df.columns:
-                st.warning(get_localized_text("時系列分析には「実施日」の列が必要です。"))
-                st.stop()
-                
-            # 実施日がPythonのdateオブジェクトになっているため、そのままdropna
-            df = df.dropna(subset=['実施日'])
+    @staticmethod
+    def build(df):
+        # レポートの全セクションをまとめて求める（必要な列がないセクションは None）
+        sections = dict.fromkeys(['team_avg', 'weekday_avg', 'time_avg', 'top_rate', 'top_satisfaction', 'low_participation'])
+        sections['corr'] = {}
+
+        if '参加者数' in df.columns:
+            # チーム別・曜日別の平均は 担当チーム × 曜日 の1回のグループ化から求める
+            keys = [key for key in ['担当チーム', '曜日'] if key in df.columns]
+            if keys:
+                partial = df.groupby(keys, observed=True, dropna=False)['参加者数'].agg(['sum', 'count'])
+                means = {}
+                for key in keys:
+                    rolled = partial.groupby(level=key, observed=True).sum()
+                    means[key] = (rolled['sum'] / rolled['count'].where(rolled['count'] > 0)).rename('参加者数')
+                if '担当チーム' in means:
+                    sections['team_avg'] = means['担当チーム'].sort_values(ascending=False).reset_index()
+                if '曜日' in means:
+                    weekday = means['曜日'].dropna()
+                    sections['weekday_avg'] = weekday.reindex(index=DataSchema.WEEKDAYS).dropna().reset_index()
+                    low = weekday.sort_values().head(ReportEngine.LOW_WEEKDAYS).reset_index()
+                    low.index += 1
+                    sections['low_participation'] = low
+
+            slot_df = DataProcessor.with_slots(DatasetView.project(df, ['参加者数']), ['時間帯スロット'])
+            if '時間帯スロット' in slot_df.columns:
+                sections['time_avg'] = slot_df.groupby('時間帯スロット', observed=True)['参加者数'].mean().sort_values(ascending=False).reset_index()
+
+        frame = ReportEngine.with_rates(df)
+        for section, rate_col in (('top_rate', '参加率(%)'), ('top_satisfaction', '満足率(%)')):
+            if rate_col in frame.columns:
+                cols = [col for col in ['イベント名', '曜日', '時間帯', rate_col] if col in frame.columns]
+                top = frame.nlargest(ReportEngine.TOP_EVENTS, rate_col)[cols].reset_index(drop=True)
+                top.index += 1
+                sections[section] = top
+
+        # 参加者数との相関は相関行列の計算でまとめて求める（列がなければ含めない）
+        corr_cols = [col for col in ['参加者数', '宣伝回数', 'リアクション率'] if col in frame.columns]
+        if '参加者数' in corr_cols and len(corr_cols) > 1:
+            matrix = CorrelationEngine.compute(frame[corr_cols], 'pearson')[None]['matrix']
+            sections['corr'] = {col: matrix.loc['参加者数', col] for col in corr_cols[1:]}
+        return sections
+
+
+class ApproxStats:
+    # HyperLogLog のレジスタ数は 2^HLL_PRECISION（標準誤差は約 1.04 / sqrt(レジスタ数)）
+    HLL_PRECISION = 12
+    HLL_ERROR = 1.04 / np.sqrt(1 << HLL_PRECISION)
+    # 分位点サマリーに残す代表値の数（順位誤差はおおよそ件数 / QUANTILE_ITEMS 以内）
+    QUANTILE_ITEMS = 200
+    # パーティションごとに足し合わせる正確な集計
+    MOMENTS = ['count', 'sum', 'sumsq']
 
-            if df.empty:
-                st.warning(get_localized_text("有効な日付データがありません。"))
-                st.stop()
+    @staticmethod
+    def partitions(df):
+        # 担当チームごとのパーティション番号（チームが欠損した行は最後の None のパーティション）
+        if '担当チーム' not in df.columns:
+            return [None], np.zeros(len(df), dtype=np.int64)
+        teams = pd.Categorical(df['担当チーム'])
+        labels = list(teams.categories) + [None]
+        codes = teams.codes.astype(np.int64)
+        return labels, np.where(codes < 0, len(labels) - 1, codes)
 
-            # DatetimeIndexの作成用に、dateオブジェクトをTimestampに変換
-            df['実施日_timestamp'] = pd.to_datetime(df['実施日'])
+    @staticmethod
+    def hll_add(registers, parts, hashes):
+        # ハッシュの上位ビットでレジスタを選び、残りのビットの先頭のゼロの数 + 1 の最大値を記録する
+        rest_bits = 64 - ApproxStats.HLL_PRECISION
+        buckets = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # rest < 2^52 なので float64 で正確に表せ、frexp の指数が最上位ビットの位置になる
+        _, exponent = np.frexp(rest.astype(np.float64))
+        rank = np.where(rest > 0, rest_bits - exponent + 1, rest_bits + 1).astype(np.uint8)
+        np.maximum.at(registers, (parts, buckets), rank)
 
+    @staticmethod
+    def hll_estimate(registers):
+        # レジスタからユニーク値数を推定する（少ない場合は空きレジスタ数による線形カウント）
+        m = registers.shape[-1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+        zeros = np.count_nonzero(registers == 0)
+        if raw <= 2.5 * m and zeros > 0:
+            return m * np.log(m / zeros)
+        return raw
 
-            cat_cols = df.select_dtypes(include='object').columns.tolist()
-            numeric_cols = df.select_dtypes(include='number').columns.tolist()
+    @staticmethod
+    def quantile_summary(values, parts, n_parts):
+        # パーティションごとに値を並べ、一定間隔ごとの値を代表値として残す（重み = 代表する件数）
+        # 推定順位の誤差は間隔未満なので、パーティションごとの誤差（件数）として記録する
+        order = np.lexsort((values, parts))
+        values, parts = values[order], parts[order]
+        sizes = np.bincount(parts, minlength=n_parts)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        stride = np.maximum(1, -(-sizes // ApproxStats.QUANTILE_ITEMS))
+        position = np.arange(len(values)) - starts[parts] + 1
+        step = stride[parts]
+        keep = (position % step == 0) | (position == sizes[parts])
+        return {
+            'values': values[keep],
+            'weights': np.where(position % step == 0, step, position % step)[keep],
+            'parts': parts[keep],
+            'error': np.where(sizes > 0, stride - 1, 0)
+        }
 
-            if not numeric_cols:
-                st.warning(get_localized_text("数値列がありません。時系列分析は数値データに基づいています。"))
-                st.stop()
+    @staticmethod
+    def build(df):
+        # 担当チーム単位のパーティションごとにスケッチを作る（HLL・分位点サマリー・正確な件数と和）
+        labels, parts = ApproxStats.partitions(df)
+        n_parts = len(labels)
+        columns = df.columns.tolist()
+        numeric = df.select_dtypes(include='number').columns.tolist()
+        sketch = {
+            'labels': labels,
+            'columns': columns,
+            'numeric': numeric,
+            'rows': np.bincount(parts, minlength=n_parts),
+            'nulls': np.zeros((n_parts, len(columns)), dtype=np.int64),
+            'hll': np.zeros((len(columns), n_parts, 1 << ApproxStats.HLL_PRECISION), dtype=np.uint8),
+            'min': np.full((len(numeric), n_parts), np.inf),
+            'max': np.full((len(numeric), n_parts), -np.inf),
+            'quantiles': {}
+        }
+        for key in ApproxStats.MOMENTS:
+            sketch[key] = np.zeros((len(numeric), n_parts))
+
+        for j, col in enumerate(columns):
+            present = df[col].notna().to_numpy()
+            sketch['nulls'][:, j] = np.bincount(parts[~present], minlength=n_parts)
+            values = df[col][present]
+            # 結合で int8 から float64 に広がっても同じ値が同じハッシュになるよう数値列は float64 に揃える
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                values = values.astype('float64')
+            hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+            ApproxStats.hll_add(sketch['hll'][j], parts[present], hashes)
+
+        for i, col in enumerate(numeric):
+            values = df[col].to_numpy(dtype=float, na_value=np.nan)
+            valid = ~np.isnan(values)
+            values, value_parts = values[valid], parts[valid]
+            sketch['count'][i] = np.bincount(value_parts, minlength=n_parts)
+            sketch['sum'][i] = np.bincount(value_parts, weights=values, minlength=n_parts)
+            sketch['sumsq'][i] = np.bincount(value_parts, weights=values * values, minlength=n_parts)
+            np.minimum.at(sketch['min'][i], value_parts, values)
+            np.maximum.at(sketch['max'][i], value_parts, values)
+            sketch['quantiles'][col] = ApproxStats.quantile_summary(values, value_parts, n_parts)
+        return sketch
 
-            col1, col2 = st.columns(2)
-            with col1:
-                trend_metric = st.selectbox(
-                    get_localized_text("分析する指標"),
-                    numeric_cols,
-                    key="trend_metric"
-                )
-                trend_group = st.selectbox(
-                    get_localized_text("グループ化（オプション）"),
-                    ['なし'] + cat_cols,
-                    key="trend_group"
-                )
+    @staticmethod
+    def merge(a, b):
+        # 2つのスケッチをまとめる（HLL はレジスタの最大値、件数と和は合計、分位点サマリーは連結）
+        labels = a['labels'][:-1] + [l for l in b['labels'][:-1] if l not in a['labels']] + [None]
+        label_pos = {l: i for i, l in enumerate(labels)}
+        n_parts = len(labels)
+        merged = {
+            'labels': labels,
+            'columns': a['columns'],
+            'numeric': a['numeric'],
+            'rows': np.zeros(n_parts, dtype=np.int64),
+            'nulls': np.zeros((n_parts, len(a['columns'])), dtype=np.int64),
+            'hll': np.zeros((len(a['columns']), n_parts, 1 << ApproxStats.HLL_PRECISION), dtype=np.uint8),
+            'min': np.full((len(a['numeric']), n_parts), np.inf),
+            'max': np.full((len(a['numeric']), n_parts), -np.inf),
+            'quantiles': {}
+        }
+        for key in ApproxStats.MOMENTS:
+            merged[key] = np.zeros((len(a['numeric']), n_parts))
+
+        parts_of = {}
+        for sketch in (a, b):
+            pos = np.array([label_pos[l] for l in sketch['labels']])
+            cols = [sketch['columns'].index(c) for c in merged['columns']]
+            nums = [sketch['numeric'].index(c) for c in merged['numeric']]
+            parts_of[id(sketch)] = pos
+            merged['rows'][pos] += sketch['rows']
+            merged['nulls'][pos] += sketch['nulls'][:, cols]
+            merged['hll'][:, pos] = np.maximum(merged['hll'][:, pos], sketch['hll'][cols])
+            for key in ApproxStats.MOMENTS:
+                merged[key][:, pos] += sketch[key][nums]
+            merged['min'][:, pos] = np.minimum(merged['min'][:, pos], sketch['min'][nums])
+            merged['max'][:, pos] = np.maximum(merged['max'][:, pos], sketch['max'][nums])
+
+        for col in merged['numeric']:
+            qa, qb = a['quantiles'][col], b['quantiles'][col]
+            error = np.zeros(n_parts, dtype=np.int64)
+            for sketch, q in ((a, qa), (b, qb)):
+                error[parts_of[id(sketch)]] += q['error']
+            merged['quantiles'][col] = {
+                'values': np.concatenate([qa['values'], qb['values']]),
+                'weights': np.concatenate([qa['weights'], qb['weights']]),
+                'parts': np.concatenate([parts_of[id(a)][qa['parts']], parts_of[id(b)][qb['parts']]]),
+                'error': error
+            }
+        return merged
 
-            with col2:
-                agg_period_display = st.selectbox(
-                    get_localized_text("集計期間"),
-                    [get_localized_text('日次'), get_localized_text('週次'), get_localized_text('月次')],
-                    key="trend_period"
-                )
-                moving_avg = st.number_input(
-                    get_localized_text("移動平均期間"), 
-                    min_value=1,
-                    max_value=30,
-                    value=7,
-                    key="trend_ma"
+    @staticmethod
+    def get_sketch(dfmain):
+        # データセットのバージョンごとに一度だけ作る
+        # 既存ファイルの末尾にファイルが追加されただけなら、追加された行のスケッチを既存のものにまとめる
+        stored = st.session_state.sketches
+        version = st.session_state.dataset_version
+        if stored.get('version') == version:
+            return stored['sketch']
+        digests = st.session_state.dataset_digests
+        previous = stored.get('digests')
+        if (
+            previous
+            and digests[:len(previous)] == previous
+            and stored['rows'] <= len(dfmain)
+            and set(stored['sketch']['columns']) == set(dfmain.columns)
+            and set(stored['sketch']['numeric']) == set(dfmain.select_dtypes(include='number').columns)
+        ):
+            sketch = stored['sketch']
+            if stored['rows'] < len(dfmain):
+                sketch = ApproxStats.merge(sketch, ApproxStats.build(dfmain.iloc[stored['rows']:]))
+        else:
+            sketch = ApproxStats.build(dfmain)
+        st.session_state.sketches = {'version': version, 'digests': list(digests), 'rows': len(dfmain), 'sketch': sketch}
+        return sketch
+
+    @staticmethod
+    def for_view(df):
+        # 表示中のデータに対応するスケッチと対象パーティションを返す
+        # チームの絞り込みだけならパーティションをまとめ、日付で行が除かれている場合は表示中の行から作る
+        sketch = ApproxStats.get_sketch(st.session_state.dfmain)
+        teams = st.session_state.filter_key[1]
+        mask = np.array([not teams or label in teams for label in sketch['labels']])
+        if sketch['rows'][mask].sum() == len(df):
+            return sketch, mask
+        cached = st.session_state.sketch_view
+        if cached.get('key') != st.session_state.filter_key:
+            cached = {'key': st.session_state.filter_key, 'sketch': ApproxStats.build(df)}
+            st.session_state.sketch_view = cached
+        return cached['sketch'], np.ones(len(cached['sketch']['labels']), dtype=bool)
+
+    @staticmethod
+    def merge_quantiles(summary, mask):
+        # 対象パーティションの分位点サマリーをまとめ、代表値が多すぎれば重みの累積で間引く
+        selected = mask[summary['parts']]
+        order = np.argsort(summary['values'][selected], kind='stable')
+        values = summary['values'][selected][order]
+        weights = summary['weights'][selected][order]
+        error = int(summary['error'][mask].sum())
+        total = int(weights.sum())
+        if len(values) > ApproxStats.QUANTILE_ITEMS:
+            # 間引いた代表値は間隔 total / QUANTILE_ITEMS 分の値を代表するので、その分だけ誤差が増える
+            step = total / ApproxStats.QUANTILE_ITEMS
+            cumulative = np.cumsum(weights)
+            bins = np.ceil(cumulative / step)
+            keep = np.r_[bins[1:] != bins[:-1], True]
+            values = values[keep]
+            weights = np.diff(np.r_[0, cumulative[keep]])
+            error += int(np.ceil(step))
+        return values, weights, error
+
+    @staticmethod
+    def column_profile(sketch, mask, columns):
+        # 列ごとの欠損値数（正確な値）とユニーク値数（HyperLogLog の推定値と標準誤差）
+        rows = sketch['rows'][mask].sum()
+        nulls = sketch['nulls'][mask].sum(axis=0)
+        distinct = np.array([
+            ApproxStats.hll_estimate(sketch['hll'][j][mask].max(axis=0))
+            for j in range(len(sketch['columns']))
+        ])
+        return pd.DataFrame({
+            'nulls': nulls,
+            'null_rate': (nulls / rows * 100).round(2),
+            'distinct': distinct.round().astype(np.int64),
+            'distinct_error': (distinct * ApproxStats.HLL_ERROR).round().astype(np.int64)
+        }, index=sketch['columns']).reindex(columns)
+
+    @staticmethod
+    def describe(sketch, mask, columns):
+        # describe() と同じ統計量。件数・平均・標準偏差・最小・最大は正確な値、四分位数は分位点サマリーから求める
+        rows = {}
+        for i, col in enumerate(sketch['numeric']):
+            count = sketch['count'][i][mask].sum()
+            total = sketch['sum'][i][mask].sum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = total / count
+                std = np.sqrt(max(sketch['sumsq'][i][mask].sum() - total * mean, 0) / (count - 1)) if count > 1 else np.nan
+            low, high = sketch['min'][i][mask].min(), sketch['max'][i][mask].max()
+            values, weights, error = ApproxStats.merge_quantiles(sketch['quantiles'][col], mask)
+            quartiles = [np.nan] * 3
+            if len(values):
+                cumulative = np.cumsum(weights)
+                quartiles = values[np.searchsorted(cumulative, [q * cumulative[-1] for q in (0.25, 0.5, 0.75)])]
+            rows[col] = {
+                'count': count,
+                'mean': mean,
+                'std': std,
+                'min': low if np.isfinite(low) else np.nan,
+                '25%': quartiles[0],
+                '50%': quartiles[1],
+                '75%': quartiles[2],
+                'max': high if np.isfinite(high) else np.nan,
+                # 推定順位の誤差（件数に対する割合, %）。補間の違いの 1 件分を含む
+                'rank_error': (error + 1) / count * 100 if count else np.nan
+            }
+        return pd.DataFrame.from_dict(rows, orient='index').reindex([c for c in columns if c in rows])
+
+
+class ResultCache:
+    # 画面ごとに保持する計算結果の件数
+    MAX_ENTRIES_PER_VIEW = 16
+
+    @staticmethod
+    def get_or_compute(view, key, compute):
+        # 画面ごとの計算結果を (フィルター状態, 画面の入力) をキーに保持する
+        # フィルター状態にはデータのバージョンが含まれるので、データが変われば再計算される
+        cache = st.session_state.result_cache.setdefault(view, {})
+        full_key = (st.session_state.filter_key, key)
+        if full_key in cache:
+            # 最近使った結果を末尾に移す（古いものから破棄する）
+            cache[full_key] = cache.pop(full_key)
+        else:
+            if len(cache) >= ResultCache.MAX_ENTRIES_PER_VIEW:
+                cache.pop(next(iter(cache)))
+            cache[full_key] = compute()
+        return cache[full_key]
+
+
+class ChartCache:
+    # 描画済みチャートを保持する合計バイト数の上限（超えたら古いものから破棄する）
+    BYTE_BUDGET = 64 * 1024 * 1024
+
+    @staticmethod
+    def get(key):
+        cache = get_chart_cache()
+        with cache['lock']:
+            payload = cache['entries'].pop(key, None)
+            if payload is not None:
+                # 最近使ったものを末尾に移す
+                cache['entries'][key] = payload
+            return payload
+
+    @staticmethod
+    def put(key, payload):
+        cache = get_chart_cache()
+        with cache['lock']:
+            if key in cache['entries']:
+                cache['bytes'] -= len(cache['entries'].pop(key))
+            cache['entries'][key] = payload
+            cache['bytes'] += len(payload)
+            while cache['bytes'] > ChartCache.BYTE_BUDGET and len(cache['entries']) > 1:
+                cache['bytes'] -= len(cache['entries'].pop(next(iter(cache['entries']))))
+
+
+class FigureManager:
+    @staticmethod
+    @contextmanager
+    def track(count=1):
+        # 描画中の Figure として数える（Figure の作成と解放は ChartDrawing.figure が行う）
+        # ワーカーで描く分は、結果が戻るまでこのプロセスで描画中として数える
+        stats = get_figure_stats()
+        with stats['lock']:
+            stats['live'] += count
+        try:
+            yield
+        finally:
+            with stats['lock']:
+                stats['live'] -= count
+
+    @staticmethod
+    def record(payload):
+        # 描画した Figure の数と画像のバイト数を集計する（ワーカーで描いた分は結果を受け取ったときに数える）
+        stats = get_figure_stats()
+        with stats['lock']:
+            stats['created'] += 1
+            stats['rendered_bytes'] += len(payload)
+
+    @staticmethod
+    def report():
+        # 現在の Figure の数と描画バイト数（ワーカーで描いた分を含む）、チャートキャッシュの使用量
+        stats = get_figure_stats()
+        cache = get_chart_cache()
+        with stats['lock']:
+            report = {key: stats[key] for key in ('live', 'created', 'rendered_bytes')}
+        with cache['lock']:
+            report['cached_charts'] = len(cache['entries'])
+            report['cached_bytes'] = cache['bytes']
+        return report
+
+
+class ChartRenderer:
+    # st.pyplot と同じ解像度で画像にする
+    DPI = 200
+
+    @staticmethod
+    def spec(kind, title, xlabel, ylabel, figsize, **options):
+        # チャートの仕様（種類・ラベル・サイズと、カラーマップなどの種類ごとの設定）
+        # 集計済みデータと合わせて描画結果のキャッシュキーになる
+        return {'kind': kind, 'title': title, 'xlabel': xlabel, 'ylabel': ylabel, 'figsize': figsize, **options}
+
+    @staticmethod
+    def key(spec, data, fmt):
+        # 仕様と集計済みデータのハッシュからキャッシュキーを作る
+        digest = hashlib.sha256(repr((fmt, sorted(spec.items()))).encode('utf-8'))
+        for frame in (data if isinstance(data, list) else [data]):
+            labels = list(frame.columns) if isinstance(frame, pd.DataFrame) else frame.name
+            digest.update(repr((labels, frame.index.names, str(frame.index.dtype))).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def render_bytes(spec, data, fmt='png'):
+        # 仕様から画像のバイト列をこのスレッドで作る
+        with FigureManager.track():
+            payload = ChartDrawing.render(spec, data, fmt, ChartRenderer.DPI, font_path)
+        FigureManager.record(payload)
+        return payload
+
+    @staticmethod
+    def render_many(charts, fmt='png'):
+        # (仕様, データ) のリストから描画済みのバイト列（PNG/SVG）のリストを返す。同じ仕様とデータなら描画し直さない
+        # キャッシュにないチャートが複数あれば、プロセスプールで並列に描く
+        keys = [ChartRenderer.key(spec, data, fmt) for spec, data in charts]
+        payloads = [ChartCache.get(key) for key in keys]
+        pending = [i for i, payload in enumerate(payloads) if payload is None]
+        rendered = None
+        workers = st.session_state.pool_workers
+        if workers > 1 and len(pending) > 1:
+            # ワーカーでは ChartDrawing.render だけを実行し、Streamlit の API は呼ばない
+            with FigureManager.track(len(pending)):
+                rendered = ProcessPool.run(
+                    ChartDrawing.render,
+                    [charts[i] + (fmt, ChartRenderer.DPI, font_path) for i in pending],
+                    workers
                 )
+            for payload in rendered or []:
+                FigureManager.record(payload)
+        if rendered is None:
+            rendered = [ChartRenderer.render_bytes(*charts[i], fmt) for i in pending]
+        for i, payload in zip(pending, rendered):
+            payloads[i] = payload
+            ChartCache.put(keys[i], payload)
+        return payloads
 
-            try:
-                trend_df = df.copy()
-                
-                period_map_internal = {
-                    get_localized_text('日次'): 'D',
-                    get_localized_text('週次'): 'W',
-                    get_localized_text('月次'): 'M'
-                }
+    @staticmethod
+    def render(spec, data, fmt='png'):
+        return ChartRenderer.render_many([(spec, data)], fmt)[0]
 
-                fig, ax = plt.subplots(figsize=(12, 6))
-                has_data_to_plot = False 
+    @staticmethod
+    def place(png, download=None):
+        # 描画済みの PNG を表示する。download=(ラベル, ファイル名, キー) を渡すと同じ PNG を保存ボタンにも使う
+        st.image(png, width='stretch')
+        if download is not None:
+            label, file_name, key = download
+            st.download_button(label, png, file_name, 'image/png', key=key)
 
-                if trend_group == 'なし':
-                    resampled = trend_df.set_index('実施日_timestamp')[trend_metric].resample(period_map_internal[agg_period_display]).mean()
-                    
-                    if not resampled.empty:
-                        resampled.plot(ax=ax, label=get_graph_text(f'{agg_period_display}平均')) # fontpropertiesを削除
-                        moving = resampled.rolling(window=moving_avg, min_periods=1).mean() 
-                        if not moving.empty:
-                            moving.plot(ax=ax, label=get_graph_text(f'{moving_avg}{agg_period_display[0]}移動平均'), style='--') # fontpropertiesを削除
-                        else:
-                            st.info(get_localized_text("移動平均を計算する十分なデータがありません。"))
-                        has_data_to_plot = True
-                    else:
-                        st.warning(get_localized_text("集計データが空のため、時系列グラフを生成できませんでした。"))
-                        
-                    if not resampled.empty:
-                        st.subheader(get_localized_text("📊 時系列の特徴"))
-                        latest_val = resampled.iloc[-1]
-                        prev_val = resampled.iloc[-2] if len(resampled) > 1 else None
-
-                        st.info(get_localized_text(f"最新の{agg_period_display}平均: {latest_val:.2f}"))
-                        if prev_val is not None and prev_val != 0:
-                            change = ((latest_val - prev_val) / prev_val * 100)
-                            st.info(get_localized_text(f"直近の{agg_period_display}からの変化率: {change:.1f}%"))
-                        else:
-                            st.info(get_localized_text("直近の変化率を計算するデータがありません。"))
+    @staticmethod
+    def show(spec, data, download=None):
+        ChartRenderer.place(ChartRenderer.render(spec, data), download)
+
+
+@st.cache_resource
+def get_figure_stats():
+    # 作成中の Figure の数・作成した Figure の累計・描画したバイト数の累計（プロセス全体で共有）
+    return {'live': 0, 'created': 0, 'rendered_bytes': 0, 'lock': threading.Lock()}
+
+@st.cache_resource
+def get_chart_cache():
+    # 描画済みチャートのキャッシュ（全セッションで共有する。キーにデータのハッシュを含むので他のデータと混ざらない）
+    return {'entries': {}, 'bytes': 0, 'lock': threading.Lock()}
+
+@st.cache_resource
+def get_process_pool():
+    # プロセス全体で共有するプロセスプール（ワーカー数ごとに1つ持ち、設定の異なるセッションが互いのプールを終了させない）
+    return {'executors': {}, 'lock': threading.Lock()}
+
+
+class ProcessPool:
+    @staticmethod
+    def context():
+        # サーバーはスレッドを持つプロセスなので fork は使わない
+        # forkserver ではワーカー用モジュールを先に読み込んだサーバーから起動し、ワーカーの起動を速くする
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['bunseki_workers'])
+            return context
+        return multiprocessing.get_context('spawn')
+
+    @staticmethod
+    def get(workers):
+        # 指定したワーカー数のプールを返す。なければ作り、他のワーカー数のプールはそのまま残す
+        # ワーカー数の選択肢は CPU コア数までなので、プールの数もそれ以上には増えない
+        pool = get_process_pool()
+        with pool['lock']:
+            executor = pool['executors'].get(workers)
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=ProcessPool.context())
+                pool['executors'][workers] = executor
+            return executor
+
+    @staticmethod
+    def discard(executor):
+        # 異常終了したワーカーがあるプールを破棄し、次回は作り直す
+        pool = get_process_pool()
+        with pool['lock']:
+            for workers, current in list(pool['executors'].items()):
+                if current is executor:
+                    del pool['executors'][workers]
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def run(func, calls, workers):
+        # calls の各引数で func をプールで並列に実行し、結果を順番どおりに返す
+        # 並列に実行できなかった場合は None を返す（呼び出し側でこのスレッドで処理する）
+        executor = ProcessPool.get(workers)
+        try:
+            futures = [executor.submit(func, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            ProcessPool.discard(executor)
+            return None
+        except (pickle.PicklingError, RuntimeError):
+            # 引数や結果を受け渡せない場合や、別のセッションがプールを破棄した直後の場合
+            return None
+
+def show_upload_section():
+    # ファイルのアップロードと取り込み（アップローダーの状態を保つため、表示中のタブに関係なく毎回実行する）
+    st.header(get_localized_text("📁 分析対象CSVファイルのアップロード"))
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        all_uploaded_files_current_run = [] 
+        uploader_objects = [] 
+        last_uploaded_idx = -1 
+
+        for i in range(st.session_state.num_uploaders):
+            label = get_localized_text("CSVファイル (必須)") if i == 0 else get_localized_text(f"追加のCSVファイル (オプション {i})")
+            file_obj = st.file_uploader(
+                label,
+                type="csv",
+                key=f"csv_upload_{i}"
+            )
+            uploader_objects.append(file_obj)
+
+            if file_obj is not None:
+                last_uploaded_idx = i
+                all_uploaded_files_current_run.append(file_obj)
+
+        new_num_uploaders = st.session_state.num_uploaders
+
+        if last_uploaded_idx != -1:
+            target_num_uploaders = last_uploaded_idx + 2
+            new_num_uploaders = max(new_num_uploaders, target_num_uploaders)
+        else:
+            new_num_uploaders = 1
+
+        if last_uploaded_idx != -1 and st.session_state.num_uploaders > (last_uploaded_idx + 2):
+            new_num_uploaders = last_uploaded_idx + 2
+        elif last_uploaded_idx == -1 and st.session_state.num_uploaders > 1:
+            new_num_uploaders = 1
+
+        if new_num_uploaders != st.session_state.num_uploaders:
+            st.session_state.num_uploaders = new_num_uploaders
+            st.rerun()
+
+        with st.expander(get_localized_text("⚙️ 読み込み設定")):
+            st.checkbox(
+                get_localized_text("大容量ファイルをチャンク単位で読み込む（メモリ節約）"),
+                key="stream_ingest"
+            )
+            st.number_input(
+                get_localized_text("1チャンクあたりの行数"),
+                min_value=10_000,
+                max_value=1_000_000,
+                step=10_000,
+                key="stream_chunksize",
+                disabled=not st.session_state.stream_ingest
+            )
+
+        current_files_hash = hash(tuple((f.name, f.size) for f in all_uploaded_files_current_run if f is not None))
+        previous_files_hash = st.session_state.get('previous_files_hash', None)
+
+        files_changed = (current_files_hash != previous_files_hash)
+
+        if files_changed and all_uploaded_files_current_run:
+            st.session_state.upload_files = all_uploaded_files_current_run
+            st.session_state.uploaded_file_processed = False
+            st.session_state.previous_files_hash = current_files_hash
+            st.rerun()
+
+        if st.session_state.upload_files and not st.session_state.uploaded_file_processed:
+            uploaded_dfs_temp = []
+            digests = [DataProcessor.file_digest(f) for f in st.session_state.upload_files]
+            DataProcessor.prune_cache(digests)
+            st.session_state.upload_digests = digests
+            chunksize = st.session_state.stream_chunksize if st.session_state.stream_ingest else None
+            entries = DataProcessor.load_files(
+                st.session_state.upload_files,
+                digests,
+                chunksize,
+                st.session_state.pool_workers
+            )
+            for f, entry in zip(st.session_state.upload_files, entries):
+                if entry['error']:
+                    st.error(get_localized_text(f"ファイル {f.name}: {entry['error']}"))
+                elif entry['df'] is not None:
+                    uploaded_dfs_temp.append(entry['df'])
+
+            if uploaded_dfs_temp:
+                # 既存のファイルはそのままで末尾にファイルが追加されただけなら、追加分だけを処理する
+                merged = None
+                previous_digests = st.session_state.dataset_digests
+                if (
+                    st.session_state.get('dfmain') is not None
+                    and st.session_state.row_hashes is not None
+                    and previous_digests
+                    and len(digests) > len(previous_digests)
+                    and digests[:len(previous_digests)] == previous_digests
+                ):
+                    new_frames = [
+                        entry['df'] for entry in entries[len(previous_digests):]
+                        if entry['df'] is not None
+                    ]
+                    if not new_frames:
+                        merged = {}
                     else:
-                        st.info(get_localized_text("集計データが空のため、特徴を抽出できません。"))
-
-                    if not resampled.empty:
-                        csv = resampled.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
-                        st.download_button(
-                            get_localized_text("📥 時系列データをCSVで保存"),
-                            csv,
-                            file_name="trend_data.csv",
-                            mime='text/csv',
-                            key="trend_download"
+                        merged = DataProcessor.append_frames(
+                            st.session_state['dfmain'],
+                            st.session_state.row_hashes,
+                            st.session_state.column_kinds,
+                            st.session_state.slot_bridge,
+                            st.session_state.heatmap_store,
+                            new_frames
                         )
-
-                else:
-                    if trend_group in trend_df.columns:
-                        groups = trend_df[trend_group].dropna().unique()
-                        if len(groups) > 0:
-                            for group in groups:
-                                if pd.notna(group) and str(group).strip() != '':
-                                    group_data = trend_df[trend_df[trend_group] == group]
-                                    if not group_data.empty:
-                                        resampled = group_data.set_index('実施日_timestamp')[trend_metric].resample(period_map_internal[agg_period_display]).mean()
-                                        if not resampled.empty:
-                                            resampled.plot(ax=ax, label=str(group)) # fontpropertiesを削除
-                                            moving = resampled.rolling(window=moving_avg, min_periods=1).mean()
-                                            if not moving.empty:
-                                                moving.plot(ax=ax, label=get_graph_text(f'{str(group)} ({moving_avg}{agg_period_display[0]}移動平均)'), style='--') # fontpropertiesを削除
-                                            else:
-                                                st.info(get_localized_text(f"グループ '{group}' の移動平均を計算する十分なデータがありません。"))
-                                            has_data_to_plot = True
-                                        else:
-                                            st.warning(get_localized_text(f"グループ '{group}' のデータが不足しているため、時系列グラフを生成できませんでした。"))
-                                    else:
-                                        st.warning(get_localized_text(f"グループ '{group}' のデータがありません。"))
-                                
-                            if not has_data_to_plot:
-                                st.warning(get_localized_text("選択されたグループのいずれも時系列データをプロットできませんでした。"))
+                if merged is None:
+                    merged = DataProcessor.combine_frames(uploaded_dfs_temp)
+
+                st.session_state.update(merged)
+                st.session_state.dataset_digests = digests
+                st.session_state.dataset_version += 1
+                st.session_state.result_cache = {}
+                # この実行では絞り込み前の全データを表示するので、サイドバーで計算済みの旧データのキーを置き換える
+                st.session_state.filter_key = (st.session_state.dataset_version, (), None)
+                df_combined = st.session_state['dfmain']
+                st.session_state.current_data = df_combined
+                st.session_state.uploaded_file_processed = True
+
+                numeric_cols_for_check = ['申込数', '参加者数', 'リアクション数', '宣伝回数', '満足回答']
+                high_nan_cols = []
+                for col in numeric_cols_for_check:
+                    if col in df_combined.columns:
+                        nan_percentage = df_combined[col].isna().sum() / len(df_combined) * 100
+                        if nan_percentage > 50: 
+                            high_nan_cols.append(f"{col} ({nan_percentage:.1f}%)")
+                if high_nan_cols:
+                    st.warning(get_localized_text(
+                        f"以下の数値列で高い欠損率が検出されました: {', '.join(high_nan_cols)}。\n"
+                        "これは、元のCSVファイルの該当列に数値以外のデータが多く含まれている可能性があります。"
+                        "データの正確性を確認してください。"
+                    ))
+            else:
+                st.session_state['dfmain'] = None
+                st.session_state.current_data = None
+                st.session_state.uploaded_file_processed = True
+                st.session_state.dataset_digests = []
+                st.session_state.row_hashes = None
+                st.session_state.column_kinds = {}
+                st.session_state.slot_bridge = None
+                st.session_state.heatmap_store = None
+                st.session_state.column_profile = None
+                st.session_state.dataset_version += 1
+                st.session_state.result_cache = {}
+                st.session_state.filter_key = None
+
+    df_display = st.session_state.get('current_data')
+    if df_display is not None and not df_display.empty:
+        if st.session_state.upload_files:
+            with col2:
+                st.markdown(get_localized_text("### 📊 ファイル情報"))
+                digests = st.session_state.upload_digests
+                for i, f in enumerate(all_uploaded_files_current_run, 1):
+                    if f is not None:
+                        display_name = f.name if hasattr(f, 'name') else get_localized_text(f"ファイル {i}")
+                        entry = st.session_state.ingest_cache.get(digests[i - 1]) if i <= len(digests) else None
+                        if entry is not None and entry['encoding']:
+                            encoding_label = DataProcessor.ENCODING_LABELS.get(entry['encoding'], entry['encoding'])
+                            st.info(get_localized_text(f"ファイル {i}: {display_name}（文字コード: {encoding_label}）"))
                         else:
-                            st.warning(get_localized_text(f"選択されたグループ列 '{trend_group}' に有効な値がありません。"))
-                    else:
-                        st.error(get_localized_text(f"選択されたグループ列 '{trend_group}' がデータフレームに存在しません。"))
-
-                if has_data_to_plot:
-                    # Apply font_prop to title, labels, and legend
-                    ax.set_title(get_graph_text(
-                        f"{trend_metric}の時系列 ({'全体' if trend_group == 'なし' else trend_group}別)"
-                    ), fontproperties=font_prop, fontsize=16)
-                    ax.set_xlabel(get_graph_text(str("実施日")), fontproperties=font_prop, fontsize=12)
-                    ax.set_ylabel(get_graph_text(f"{trend_metric} ({agg_period_display}平均)"), fontproperties=font_prop, fontsize=12)
-                    ax.legend(prop=font_prop) # Use font_prop directly for legend
-                    ax.set_xticklabels(ax.get_xticklabels(), fontproperties=font_prop)
-                    ax.set_yticklabels(ax.get_yticklabels(), fontproperties=font_prop)
-                    for label in ax.get_xticklabels():
-                        label.set_fontproperties(font_prop)
-                    for label in ax.get_yticklabels():
-                        label.set_fontproperties(font_prop)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                else:
-                    plt.close(fig) 
+                            st.info(get_localized_text(f"ファイル {i}: {display_name}"))
 
+            if len(st.session_state.upload_files) > 1: 
+                st.markdown(get_localized_text("### 🔄 データ統合結果"))
+                # 行数は取り込みキャッシュから取得する（ファイルの再読み込みはしない）
+                total_rows_before = 0
+                for digest in st.session_state.upload_digests:
+                    entry = st.session_state.ingest_cache.get(digest)
+                    if entry is not None:
+                        total_rows_before += entry['rows']
+
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric(get_localized_text("アップロードされた全てのデータ数"), f"{total_rows_before}{get_localized_text('行')}")
+                with col2:
+                    st.metric(get_localized_text("統合後のデータ数"), f"{len(df_display)}{get_localized_text('行')}")
+                with col3:
+                    removed_rows = total_rows_before - len(df_display)
+                    if removed_rows > 0:
+                        st.metric(get_localized_text("重複削除"), f"{removed_rows}{get_localized_text('行')}")
+                        st.info(get_localized_text(
+                            f"※ {removed_rows}行の重複（全ての列が完全に一致する行）を削除しました。"
+                        ))
+            else:
+                st.info(get_localized_text(f"単一ファイル（{len(df_display)}行）を処理します"))
 
-            except Exception as e:
-                st.error(get_localized_text(f"時系列分析中にエラーが発生: {e}"))
+
+def show_data_view():
+    title_font = {
+        'fontsize': 14,
+        'fontweight': 'bold'
+    }
+
+    df_display = st.session_state.get('current_data')
+    if df_display is None or df_display.empty:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。"))
+        return
+
+    st.markdown(get_localized_text("### 📋 データプレビュー"))
+    preview_rows = st.number_input(
+        get_localized_text("表示する行数（0で全行表示）"),
+        min_value=0,
+        max_value=len(df_display),
+        value=5
+    )
+
+    if preview_rows == 0:
+        st.dataframe(df_display, use_container_width=True)
+    else:
+        st.dataframe(df_display.head(preview_rows), use_container_width=True)
+
+    # 近似統計モードでは、データセットごとに作ったスケッチから列情報と基本統計量を求める
+    approx = st.session_state.approx_stats
+    # 正確なプロファイル（全列の並べ替えを含む）は近似統計モードでは作らない
+    if approx:
+        sketch, partitions = ApproxStats.for_view(df_display)
+        profile = None
+    else:
+        profile = ColumnProfiler.for_view(df_display)
+
+    st.markdown(get_localized_text("### 📋 列情報"))
+    if approx:
+        approx_profile = ApproxStats.column_profile(sketch, partitions, df_display.columns)
+        col_info = pd.DataFrame({
+            get_localized_text('データ型'): df_display.dtypes,
+            get_localized_text('欠損値数'): approx_profile['nulls'],
+            get_localized_text('欠損率(%)'): approx_profile['null_rate'],
+            get_localized_text('ユニーク値数'): approx_profile['distinct'],
+            get_localized_text('ユニーク値数の誤差(±)'): approx_profile['distinct_error'],
+        })
+        st.caption(get_localized_text(
+            f"ユニーク値数は HyperLogLog による推定値です（標準誤差 約{ApproxStats.HLL_ERROR * 100:.1f}%）。欠損値数は正確な値です。"
+        ))
+    else:
+        col_info = pd.DataFrame({
+            get_localized_text('データ型'): profile['columns']['dtype'],
+            get_localized_text('欠損値数'): profile['columns']['nulls'],
+            get_localized_text('欠損率(%)'): profile['columns']['null_rate'],
+            get_localized_text('ユニーク値数'): profile['columns']['distinct'],
+            get_localized_text('上位カテゴリ（件数）'): profile['columns']['top'],
+        })
+    st.dataframe(col_info)
+
+    st.markdown(get_localized_text("### 📊 基本統計量"))
+    numeric_cols = df_display.select_dtypes(include='number').columns
+    if not numeric_cols.empty:
+        if approx:
+            stats_df = ApproxStats.describe(sketch, partitions, numeric_cols)
+            st.caption(get_localized_text(
+                "四分位数（25%・中央値・75%）は分位点サマリーによる近似値で、順位の誤差は「順位誤差(±%)」以内です。その他の統計量は正確な値です。"
+            ))
+        else:
+            stats_df = profile['numeric']
+
+        rename_map = {
+            "count": get_localized_text("データ数"),
+            "mean": get_localized_text("平均"),
+            "std": get_localized_text("標準偏差"),
+            "min": get_localized_text("最小値"),
+            "25%": "25%",
+            "50%": get_localized_text("中央値"),
+            "75%": "75%",
+            "max": get_localized_text("最大値"),
+            "rank_error": get_localized_text("順位誤差(±%)")
+        }
+
+        stats_df = stats_df.rename(columns=rename_map)
+        st.dataframe(stats_df)
+
+
+    st.markdown(get_localized_text("### 📊 カテゴリ列の内訳"))
+    category_cols = pd.Index(DataSchema.category_columns(df_display))
+    if not category_cols.empty:
+        selected_col = st.selectbox(get_localized_text("確認する列を選択"), category_cols)
+        if profile is not None:
+            value_counts = profile['counts'][selected_col]
         else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+            # 近似統計モードでは選択した列の件数だけを数える
+            value_counts = ResultCache.get_or_compute(
+                'data', ('counts', selected_col), lambda: ColumnProfiler.category_counts(df_display[selected_col])
+            )
+
+        ChartRenderer.show(ChartRenderer.spec(
+            'count',
+            get_graph_text(f"{selected_col}の値カウント"),
+            get_graph_text(str(selected_col)),
+            get_graph_text("カウント"),
+            (6.4, 4.8),
+            title_font=title_font,
+            rotation=45
+        ), value_counts)
 
 
-    with tabs[5]:
-        st.header(get_localized_text("🏆 ランキング分析"))
+def show_analysis_view():
+    st.header(get_localized_text("📈 分析・比較"))
 
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
+    df = DatasetView.current()
+    if df is not None:
 
-            numeric_cols = df.select_dtypes(include='number').columns.tolist()
-            cat_cols = df.select_dtypes(include='object').columns.tolist()
+        col1, col2 = st.columns(2)
+        with col1:
+            num_cols = df.select_dtypes(include='number').columns.tolist()
+            cat_cols = DataProcessor.grouping_columns(df)
 
-            if not numeric_cols:
+            if not num_cols:
                 st.warning(get_localized_text("数値列がありません。"))
                 st.stop()
             if not cat_cols:
                 st.warning(get_localized_text("カテゴリ列がありません。"))
                 st.stop()
 
-            col1, col2 = st.columns(2)
-            with col1:
-                rank_metric = st.selectbox(
-                    get_localized_text("ランキング対象の指標"), 
-                    numeric_cols,
-                    key="rank_metric"
+            target_num = st.selectbox(get_localized_text("分析対象（数値）"), num_cols)
+            group_col = st.selectbox(get_localized_text("グループ化（カテゴリ）"), cat_cols)
+
+        with col2:
+            agg_options = [
+                get_localized_text('平均'),
+                get_localized_text('合計'),
+                get_localized_text('中央値'),
+                get_localized_text('最大'),
+                get_localized_text('最小'),
+                get_localized_text('データ数')
+            ]
+            selected_aggs_display = st.multiselect(
+                get_localized_text("表示する統計指標"),
+                agg_options,
+                default=agg_options
+            )
+            outliers = OutlierService.controls('analysis', group_col)
+
+        try:
+            agg_map_internal = {
+                get_localized_text('平均'): 'mean',
+                get_localized_text('合計'): 'sum',
+                get_localized_text('中央値'): 'median',
+                get_localized_text('最大'): 'max',
+                get_localized_text('最小'): 'min',
+                get_localized_text('データ数'): 'count'
+            }
+
+            agg_funcs_list = [agg_map_internal[a] for a in selected_aggs_display if a in agg_map_internal] 
+
+            if outliers is not None:
+                # 外れ値除外は対象列ごとに行が変わるため、キューブを使わずに集計する
+                source, excluded = OutlierService.exclude(df, target_num, outliers)
+                if excluded:
+                    st.caption(get_localized_text(f"外れ値として {excluded} 行を除外しました。"))
+                else:
+                    st.info(get_localized_text(f"'{target_num}'に外れ値は見つからなかったため、全ての行で集計しました。"))
+
+                grouped = ResultCache.get_or_compute(
+                    'analysis',
+                    (target_num, group_col, tuple(agg_funcs_list), outliers),
+                    lambda: DataProcessor.with_slots(DatasetView.project(source, [target_num, group_col]), [group_col])
+                    .groupby(group_col, observed=True)[target_num].agg(agg_funcs_list)
                 )
-                rank_group = st.selectbox(
-                    get_localized_text("グループ化"),
-                    cat_cols,
-                    key="rank_group"
+            else:
+                # 対象・グループ・統計指標の切り替えはキューブの参照だけで済ませる
+                grouped = GroupCube.lookup(GroupCube.get(df, group_col), target_num, agg_funcs_list)
+
+            # 存在するカラムのみリネーム
+            rename_dict = {agg_map_internal[a]: f"{target_num}_{a}" for a in selected_aggs_display if agg_map_internal[a] in grouped.columns}
+            grouped_df = grouped.rename(columns=rename_dict)
+
+            if not grouped_df.empty:
+                st.markdown(get_localized_text("### 📊 グループ別集計結果"))
+                st.dataframe(grouped_df.round(2), use_container_width=True)
+
+                if selected_aggs_display:
+                    st.markdown(get_localized_text("### 📈 統計指標別グラフ"))
+                    # 統計指標ごとのチャートをまとめて（未描画のものは並列に）描いてから並べる
+                    charts = []
+                    for metric_display_name in selected_aggs_display:
+                        col_name_for_plot = f"{target_num}_{metric_display_name}" 
+                        if col_name_for_plot in grouped_df.columns:
+                            spec = ChartRenderer.spec(
+                                'bar',
+                                get_graph_text(f"{group_col}ごとの{target_num}（{metric_display_name}）"),
+                                get_graph_text(group_col),
+                                get_graph_text(f"{target_num}の{metric_display_name}"),
+                                (8, 4),
+                                rotation=45
+                            )
+                            charts.append((metric_display_name, spec, grouped_df[col_name_for_plot]))
+                    images = ChartRenderer.render_many([(spec, data) for _, spec, data in charts])
+
+                    cols = st.columns(2)
+                    for i, ((metric_display_name, _, _), png) in enumerate(zip(charts, images)):
+                        with cols[i % 2]:
+                            ChartRenderer.place(
+                                png,
+                                download=(get_localized_text(f"📥 {metric_display_name}のグラフを保存"), f"analysis_{metric_display_name}.png", None)
+                            )
+            else:
+                st.warning(get_localized_text("集計結果がありません。フィルター設定またはデータを確認してください。"))
+
+        except Exception as e:
+            st.error(get_localized_text(f"分析エラー: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+
+
+def show_crosstab_view():
+    st.header(get_localized_text("📊 クロス集計"))
+
+    df = DatasetView.current()
+    if df is not None:
+
+        cat_cols = DataProcessor.grouping_columns(df)
+        num_cols = df.select_dtypes(include='number').columns.tolist()
+
+        if len(cat_cols) < 2:
+            st.warning(get_localized_text("クロス集計には2つ以上のカテゴリ列が必要です。"))
+            st.stop()
+        if not num_cols:
+            st.warning(get_localized_text("数値列がありません。"))
+            st.stop()
+
+        col1 = st.selectbox(get_localized_text("行カテゴリ"), cat_cols, key="cross_row")
+        col2_options = [c for c in cat_cols if c != col1]
+        if not col2_options:
+            st.warning(get_localized_text(f"'{col1}' 以外のカテゴリ列がありません。"))
+            st.stop()
+        col2 = st.selectbox(get_localized_text("列カテゴリ"), col2_options, key="cross_col")
+
+        num_col = st.selectbox(get_localized_text("数値項目"), num_cols, key="cross_num")
+        agg_method_display = st.selectbox(get_localized_text("集計方法"), [
+            get_localized_text('平均'),
+            get_localized_text('合計'),
+            get_localized_text('中央値'),
+            get_localized_text('最大'),
+            get_localized_text('最小'),
+            get_localized_text('データ数')
+        ], key="cross_agg")
+        drill_options = ['なし'] + [c for c in cat_cols if c not in (col1, col2)]
+        drill_col = st.selectbox(get_localized_text("ドリルダウン（第3の軸）"), drill_options, key="cross_drill")
+        cross_outliers = OutlierService.controls('cross', col1)
+
+        # 一度実行した (行, 列, 数値項目) は、集計方法やドリルダウンを変えても表示し続ける
+        cross_key = (st.session_state.filter_key, col1, col2, num_col)
+        if st.button(get_localized_text("クロス集計を実行"), key="cross_execute"):
+            st.session_state.cross_active = cross_key
+        if st.session_state.cross_active == cross_key:
+            try:
+                agg_map_internal = {
+                    get_localized_text('平均'): 'mean',
+                    get_localized_text('合計'): 'sum',
+                    get_localized_text('中央値'): 'median',
+                    get_localized_text('最大'): 'max',
+                    get_localized_text('最小'): 'min',
+                    get_localized_text('データ数'): 'count'
+                }
+
+                if num_col in df.columns:
+                    source, excluded = OutlierService.exclude(df, num_col, cross_outliers)
+                    if excluded:
+                        st.caption(get_localized_text(f"外れ値として {excluded} 行を除外しました。"))
+                    cube = CrossTabEngine.get_cube(source, col1, col2, num_col, cross_outliers)
+                    if drill_col == 'なし':
+                        partials = cube['base']
+                    else:
+                        partials = CrossTabEngine.drill_down(source, cube, col1, col2, num_col, drill_col)
+                    cross_table = CrossTabEngine.table(partials, agg_map_internal[agg_method_display])
+
+                    st.dataframe(cross_table)
+
+                    ChartRenderer.show(ChartRenderer.spec(
+                        'bar',
+                        get_graph_text(f"{col1} × {col2} の {agg_method_display}"),
+                        get_graph_text(col1 if drill_col == 'なし' else f"{col1} / {drill_col}"),
+                        get_graph_text(num_col),
+                        (10, 5),
+                        rotation=45
+                    ), cross_table)
+
+                    csv = cross_table.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
+                    st.download_button(
+                        get_localized_text("📥 クロス集計結果をCSVで保存"),
+                        csv,
+                        file_name="cross_table.csv",
+                        mime='text/csv',
+                        key="cross_download"
+                    )
+                else:
+                    st.error(get_localized_text("選択された列がデータフレームに存在しません。"))
+
+            except Exception as e:
+                st.error(get_localized_text(f"クロス集計の実行に失敗しました: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+
+
+def show_heatmap_view():
+    st.header(get_localized_text("🟥 ヒートマップ"))
+
+    df = DatasetView.current()
+    if df is not None:
+
+        # 行を展開せず、取り込み時に作った 曜日 × 時間帯スロット のストアから集計する
+        store = HeatmapStore.for_view(df)
+        if store is None:
+            st.warning(get_localized_text("ヒートマップを作成するには「時間帯」と「曜日」の列が必要です。"))
+            st.stop()
+
+
+        numeric_cols = store['metrics']
+        if not numeric_cols:
+            st.warning(get_localized_text("数値列がありません。ヒートマップは数値データに基づいています。"))
+            st.stop()
+
+        col1, col2 = st.columns(2)
+        with col1:
+            heat_metric = st.selectbox(
+                get_localized_text("集計する指標"),
+                numeric_cols,
+                key="heat_metric"
+            )
+            agg_method_display = st.selectbox(
+                get_localized_text("集計方法"),
+                [get_localized_text('平均'), get_localized_text('合計'), get_localized_text('データ数'), get_localized_text('標準偏差')],
+                key="heat_agg"
+            )
+
+        with col2:
+            color_scale = st.selectbox(
+                get_localized_text("カラースケール"),
+                ['YlOrRd', 'viridis', 'coolwarm'],
+                key="heat_color"
+            )
+            normalize = st.checkbox(get_localized_text("データを正規化"), value=True, key="heat_normalize")
+
+        if st.button(get_localized_text("ヒートマップを生成"), key="heat_execute"):
+            try:
+                agg_map_internal = {
+                    get_localized_text('平均'): 'mean',
+                    get_localized_text('合計'): 'sum',
+                    get_localized_text('データ数'): 'count',
+                    get_localized_text('標準偏差'): 'std'
+                }
+                pivot_table = HeatmapStore.pivot(store, heat_metric, agg_map_internal[agg_method_display])
+
+                weekdays = DataSchema.WEEKDAYS
+                existing_weekdays = [day for day in weekdays if day in pivot_table.columns]
+                pivot_table = pivot_table.reindex(columns=existing_weekdays)
+
+                try:
+                    pivot_table = pivot_table.reindex(sorted(pivot_table.index))
+                except Exception:
+                    pass
+
+                if normalize and not pivot_table.empty and pivot_table.std().std() > 0:
+                    pivot_table = (pivot_table - pivot_table.mean().mean()) / pivot_table.std().std()
+                elif normalize and not pivot_table.empty: # 標準偏差が0の場合
+                    st.info(get_localized_text("データにばらつきがないため、ヒートマップの正規化はスキップされました。"))
+
+
+                ChartRenderer.show(ChartRenderer.spec(
+                    'heatmap',
+                    get_graph_text(f"時間帯×曜日の{heat_metric}（{agg_method_display}）"),
+                    get_graph_text("曜日"),
+                    get_graph_text("時間帯スロット"),
+                    (12, 8),
+                    title_font={'fontsize': 16},
+                    label_font={'fontsize': 12},
+                    cmap=color_scale,
+                    annot=True,
+                    rotation=45
+                ), pivot_table)
+
+                csv = pivot_table.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
+                st.download_button(
+                    get_localized_text("📥 ヒートマップデータをCSVで保存"),
+                    csv,
+                    file_name="heatmap_data.csv",
+                    mime='text/csv',
+                    key="heat_download"
                 )
 
-            with col2:
-                top_n = st.number_input(
-                    get_localized_text("表示件数"),
+                st.subheader(get_localized_text("📊 特徴的なパターン"))
+
+                if not pivot_table.empty:
+                    max_val_series = pivot_table.max()
+                    if not max_val_series.empty:
+                        max_val = max_val_series.max()
+                    else:
+                        max_val = np.nan
+
+                    min_val_series = pivot_table.min()
+                    if not min_val_series.empty:
+                        min_val = min_val_series.min()
+                    else:
+                        min_val = np.nan
+
+                    if not np.isnan(max_val) and not pivot_table[pivot_table == max_val].empty:
+                        max_pos_df = pivot_table[pivot_table == max_val].stack().dropna().index[0]
+                        st.info(get_localized_text(
+                            f"🔺 最も{heat_metric}が高い時間帯: {max_pos_df[0]}の{max_pos_df[1]}曜日 ({max_val:.2f})"
+                        ))
+                    else:
+                        st.info(get_localized_text("🔺 最も高い値のパターンを特定できませんでした。"))
+
+                    if not np.isnan(min_val) and not pivot_table[pivot_table == min_val].empty:
+                        min_pos_df = pivot_table[pivot_table == min_val].stack().dropna().index[0]
+                        st.info(get_localized_text(
+                            f"🔻 最も{heat_metric}が低い時間帯: {min_pos_df[0]}の{min_pos_df[1]}曜日 ({min_val:.2f})"
+                        ))
+                    else:
+                        st.info(get_localized_text("🔻 最も低い値のパターンを特定できませんでした。"))
+                else:
+                    st.info(get_localized_text("ヒートマップデータが空のため、特徴的なパターンを特定できません。"))
+
+
+            except Exception as e:
+                st.error(get_localized_text(f"ヒートマップ生成中にエラーが発生: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+
+
+def show_trend_view():
+    st.header(get_localized_text("📉 時系列分析"))
+
+    df = DatasetView.current()
+    if df is not None:
+
+        if '実施日' not in df.columns:
+            st.warning(get_localized_text("時系列分析には「実施日」の列が必要です。"))
+            st.stop()
+
+        df = df.dropna(subset=['実施日'])
+
+        if df.empty:
+            st.warning(get_localized_text("有効な日付データがありません。"))
+            st.stop()
+
+
+        cat_cols = DataProcessor.grouping_columns(df)
+        numeric_cols = df.select_dtypes(include='number').columns.tolist()
+
+        if not numeric_cols:
+            st.warning(get_localized_text("数値列がありません。時系列分析は数値データに基づいています。"))
+            st.stop()
+
+        col1, col2 = st.columns(2)
+        with col1:
+            trend_metric = st.selectbox(
+                get_localized_text("分析する指標"),
+                numeric_cols,
+                key="trend_metric"
+            )
+            trend_group = st.selectbox(
+                get_localized_text("グループ化（オプション）"),
+                ['なし'] + cat_cols,
+                key="trend_group"
+            )
+
+        with col2:
+            agg_period_display = st.selectbox(
+                get_localized_text("集計期間"),
+                [get_localized_text('日次'), get_localized_text('週次'), get_localized_text('月次')],
+                key="trend_period"
+            )
+            moving_avg = st.number_input(
+                get_localized_text("移動平均期間"), 
+                min_value=1,
+                max_value=30,
+                value=7,
+                key="trend_ma"
+            )
+            downsample = st.checkbox(
+                get_localized_text("グラフ表示用に点数を間引く（LTTB）"),
+                value=True,
+                key="trend_downsample",
+                help=get_localized_text("グラフの横幅（ピクセル数）を超える点を間引いて描画します。CSVには間引く前のデータを保存します。")
+            )
+
+        try:
+            period_map_internal = {
+                get_localized_text('日次'): 'D',
+                get_localized_text('週次'): 'W',
+                get_localized_text('月次'): 'M'
+            }
+
+            # 描く系列と (凡例, 線のスタイル) を集めてから、まとめて1枚のチャートにする
+            lines = []
+            line_styles = []
+            has_data_to_plot = False 
+
+            if trend_group == 'なし':
+                rollup = TrendEngine.get_rollup(df, trend_metric, None, period_map_internal[agg_period_display])
+                inside = rollup['inside'][trend_metric]
+                resampled = rollup['mean'][trend_metric][inside]
+
+                if not resampled.empty:
+                    lines.append(resampled)
+                    line_styles.append((get_graph_text(f'{agg_period_display}平均'), None))
+                    moving = TrendEngine.moving_average(rollup, moving_avg)[trend_metric][inside]
+                    if not moving.empty:
+                        lines.append(moving)
+                        line_styles.append((get_graph_text(f'{moving_avg}{agg_period_display[0]}移動平均'), '--'))
+                    else:
+                        st.info(get_localized_text("移動平均を計算する十分なデータがありません。"))
+                    has_data_to_plot = True
+                else:
+                    st.warning(get_localized_text("集計データが空のため、時系列グラフを生成できませんでした。"))
+
+                if not resampled.empty:
+                    st.subheader(get_localized_text("📊 時系列の特徴"))
+                    latest_val = resampled.iloc[-1]
+                    prev_val = resampled.iloc[-2] if len(resampled) > 1 else None
+
+                    st.info(get_localized_text(f"最新の{agg_period_display}平均: {latest_val:.2f}"))
+                    if prev_val is not None and prev_val != 0:
+                        change = ((latest_val - prev_val) / prev_val * 100)
+                        st.info(get_localized_text(f"直近の{agg_period_display}からの変化率: {change:.1f}%"))
+                    else:
+                        st.info(get_localized_text("直近の変化率を計算するデータがありません。"))
+                else:
+                    st.info(get_localized_text("集計データが空のため、特徴を抽出できません。"))
+
+                if not resampled.empty:
+                    csv = resampled.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
+                    st.download_button(
+                        get_localized_text("📥 時系列データをCSVで保存"),
+                        csv,
+                        file_name="trend_data.csv",
+                        mime='text/csv',
+                        key="trend_download"
+                    )
+
+            else:
+                if trend_group in cat_cols:
+                    rollup = TrendEngine.get_rollup(df, trend_metric, trend_group, period_map_internal[agg_period_display])
+                    moving_all = TrendEngine.moving_average(rollup, moving_avg)
+                    groups = [g for g in rollup['mean'].columns if str(g).strip() != '']
+                    if len(groups) > 0:
+                        for group in groups:
+                            inside = rollup['inside'][group]
+                            resampled = rollup['mean'][group][inside]
+                            if not resampled.empty:
+                                lines.append(resampled)
+                                line_styles.append((str(group), None))
+                                moving = moving_all[group][inside]
+                                if not moving.empty:
+                                    lines.append(moving)
+                                    line_styles.append((get_graph_text(f'{str(group)} ({moving_avg}{agg_period_display[0]}移動平均)'), '--'))
+                                else:
+                                    st.info(get_localized_text(f"グループ '{group}' の移動平均を計算する十分なデータがありません。"))
+                                has_data_to_plot = True
+                            else:
+                                st.warning(get_localized_text(f"グループ '{group}' のデータが不足しているため、時系列グラフを生成できませんでした。"))
+
+                        if not has_data_to_plot:
+                            st.warning(get_localized_text("選択されたグループのいずれも時系列データをプロットできませんでした。"))
+                    else:
+                        st.warning(get_localized_text(f"選択されたグループ列 '{trend_group}' に有効な値がありません。"))
+                else:
+                    st.error(get_localized_text(f"選択されたグループ列 '{trend_group}' がデータフレームに存在しません。"))
+
+            if has_data_to_plot:
+                # 間引きは描画にだけ使い、特徴量や CSV は集計したままの系列から求める
+                figsize = (12, 6)
+                if downsample:
+                    total_points = sum(len(series) for series in lines)
+                    lines = TrendEngine.get_display_lines(
+                        lines,
+                        (trend_metric, trend_group, period_map_internal[agg_period_display], moving_avg),
+                        figsize[0] * ChartRenderer.DPI
+                    )
+                    shown_points = sum(len(series) for series in lines)
+                    if shown_points < total_points:
+                        st.caption(get_localized_text(f"グラフの表示点数: {shown_points:,} / {total_points:,}"))
+                ChartRenderer.show(ChartRenderer.spec(
+                    'line',
+                    get_graph_text(f"{trend_metric}の時系列 ({'全体' if trend_group == 'なし' else trend_group}別)"),
+                    get_graph_text("実施日"),
+                    get_graph_text(f"{trend_metric} ({agg_period_display}平均)"),
+                    figsize,
+                    title_font={'fontsize': 16},
+                    label_font={'fontsize': 12},
+                    lines=tuple(line_styles)
+                ), lines)
+
+
+        except Exception as e:
+            st.error(get_localized_text(f"時系列分析中にエラーが発生: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+
+
+def show_ranking_view():
+    st.header(get_localized_text("🏆 ランキング分析"))
+
+    df = DatasetView.current()
+    if df is not None:
+
+        numeric_cols = df.select_dtypes(include='number').columns.tolist()
+        cat_cols = DataProcessor.grouping_columns(df)
+
+        if not numeric_cols:
+            st.warning(get_localized_text("数値列がありません。"))
+            st.stop()
+        if not cat_cols:
+            st.warning(get_localized_text("カテゴリ列がありません。"))
+            st.stop()
+
+        col1, col2 = st.columns(2)
+        with col1:
+            rank_metric = st.selectbox(
+                get_localized_text("ランキング対象の指標"), 
+                numeric_cols,
+                key="rank_metric"
+            )
+            rank_group = st.selectbox(
+                get_localized_text("グループ化"),
+                cat_cols,
+                key="rank_group"
+            )
+            rank_outliers = OutlierService.controls('rank', rank_group)
+
+        with col2:
+            top_n = st.number_input(
+                get_localized_text("表示件数"),
+                min_value=1,
+                max_value=50,
+                value=10,
+                key="rank_topn"
+            )
+            ascending_option = st.radio(
+                get_localized_text("並び順"),
+                [get_localized_text("降順（大きい順）"), get_localized_text("昇順（小さい順）")],
+                index=0,
+                key="rank_order"
+            )
+            min_count = st.number_input(
+                get_localized_text("最小データ数"),
+                min_value=1,
+                value=1,
+                key="rank_min_count"
+            )
+
+        # 一度表示した (グループ, 指標) は、並び順・件数・ページを変えても表示し続ける
+        rank_key = (st.session_state.filter_key, rank_group, rank_metric)
+        if st.button(get_localized_text("ランキングを表示"), key="rank_execute"):
+            st.session_state.rank_active = rank_key
+            st.session_state.rank_page = 1
+        if st.session_state.rank_active == rank_key:
+            try:
+                if rank_group not in cat_cols or rank_metric not in numeric_cols:
+                    st.error(get_localized_text("選択された列がデータフレームに存在しません。"))
+                    st.stop()
+
+                aggregates = RankingService.aggregates(df, rank_group, rank_metric, rank_outliers)
+                ascending = (ascending_option == get_localized_text("昇順（小さい順）"))
+                eligible = RankingService.eligible(aggregates, min_count)
+                page_count = max(1, -(-len(eligible) // top_n))
+                page = st.number_input(
+                    get_localized_text(f"ページ（全{page_count}ページ）"),
                     min_value=1,
-                    max_value=50,
-                    value=10,
-                    key="rank_topn"
-                )
-                ascending_option = st.radio(
-                    get_localized_text("並び順"),
-                    [get_localized_text("降順（大きい順）"), get_localized_text("昇順（小さい順）")],
-                    index=0,
-                    key="rank_order"
+                    max_value=page_count,
+                    key="rank_page"
                 )
+                ranked = RankingService.select(eligible, ascending, (page - 1) * top_n, top_n)
 
-            if st.button(get_localized_text("ランキングを表示"), key="rank_execute"):
-                try:
-                    if rank_group not in df.columns or rank_metric not in df.columns:
-                        st.error(get_localized_text("選択された列がデータフレームに存在しません。"))
-                        st.stop()
-
-                    rank_df = df.groupby(rank_group)[rank_metric].agg(['mean', 'count']).round(2)
-                    rank_df.columns = [get_localized_text('平均値'), get_localized_text('データ数')]
-                    rank_df = rank_df.sort_values(
-                        get_localized_text('平均値'),
-                        ascending=(ascending_option == get_localized_text("昇順（小さい順）"))
-                    )
+                st.subheader(get_localized_text("📊 ランキング結果"))
+                rank_display = ranked[['rank', 'mean', 'count']]
+                rank_display.columns = [get_localized_text('順位'), get_localized_text('平均値'), get_localized_text('データ数')]
+                rank_display.index.name = rank_group
+                st.dataframe(rank_display)
 
-                    st.subheader(get_localized_text("📊 ランキング結果"))
-                    rank_display = rank_df.head(top_n).copy()
-                    rank_display.index.name = rank_group
-                    st.dataframe(rank_display)
-
-                    fig, ax = plt.subplots(figsize=(10, max(5, top_n * 0.3)))
-                    rank_display[get_localized_text('平均値')].plot(kind='barh', ax=ax)
-                    # Apply font_prop to title, labels, and ticks
-                    ax.set_title(get_graph_text(f"{rank_group}別 {rank_metric}のランキング"), fontproperties=font_prop, fontsize=16)
-                    ax.set_xlabel(get_graph_text(str(f"{rank_metric} 平均値")), fontproperties=font_prop, fontsize=12)
-                    ax.set_ylabel(get_graph_text(rank_group), fontproperties=font_prop, fontsize=12) # Group name is data, keep as is
-                    ax.set_xticklabels(ax.get_xticklabels(), fontproperties=font_prop)
-                    ax.set_yticklabels(ax.get_yticklabels(), fontproperties=font_prop)
-                    ax.set_xlabel(get_graph_text(str(f"{rank_metric} 平均値")), fontproperties=font_prop)
-
-                    for label in ax.get_xticklabels():
-                        label.set_fontproperties(font_prop)
-                    for label in ax.get_yticklabels():
-                        label.set_fontproperties(font_prop)
-
-                    plt.tight_layout()
-                    st.pyplot(fig)
+                if rank_display.empty:
+                    st.info(get_localized_text("条件に合うグループがありません。最小データ数を見直してください。"))
+                else:
+                    ChartRenderer.show(ChartRenderer.spec(
+                        'barh',
+                        get_graph_text(f"{rank_group}別 {rank_metric}のランキング"),
+                        get_graph_text(f"{rank_metric} 平均値"),
+                        get_graph_text(rank_group),
+                        (10, max(5, top_n * 0.3)),
+                        title_font={'fontsize': 16},
+                        label_font={'fontsize': 12}
+                    ), rank_display[get_localized_text('平均値')])
 
                     csv = rank_display.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
                     st.download_button(
@@ -1123,16 +2574,16 @@ def show_main_app():
 
                     st.subheader(get_localized_text("📈 特徴的なデータ"))
 
-                    if not rank_display.empty:
-                        top_item = rank_display.index[0]
-                        top_val = rank_display.loc[top_item, get_localized_text('平均値')]
+                    leaders = RankingService.select(eligible, ascending, 0, 2)
+                    if not leaders.empty:
+                        top_item = leaders.index[0]
+                        top_val = leaders['mean'].iloc[0]
                         st.info(get_localized_text(
                             f"🏆 トップの{rank_group}: {top_item} ({top_val:.2f})"
                         ))
 
-                        if len(rank_display) > 1:
-                            second_item = rank_display.index[1]
-                            second_val = rank_display.loc[second_item, get_localized_text('平均値')]
+                        if len(leaders) > 1:
+                            second_val = leaders['mean'].iloc[1]
                             if pd.notna(top_val) and pd.notna(second_val):
                                 diff = top_val - second_val
                                 if second_val != 0:
@@ -1148,105 +2599,300 @@ def show_main_app():
                     else:
                         st.info(get_localized_text("ランキングデータが空のため、特徴的なデータを特定できません。"))
 
-                except Exception as e:
-                    st.error(get_localized_text(f"ランキング分析中にエラーが発生: {e}"))
-        else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
-
-    with tabs[6]:
-        st.header(get_localized_text("📋 自動レポート"))
+            except Exception as e:
+                st.error(get_localized_text(f"ランキング分析中にエラーが発生: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
 
-        if 'current_data' in st.session_state and st.session_state.current_data is not None and not st.session_state.current_data.empty:
-            df = st.session_state.current_data.copy()
 
-            if '参加率(%)' not in df.columns and '申込数' in df.columns and '参加者数' in df.columns:
-                df['参加率(%)'] = (df['参加者数'] / df['申込数']) * 100
-            if '満足率(%)' not in df.columns and '満足回答' in df.columns and '参加者数' in df.columns:
-                df['満足率(%)'] = (df['満足回答'] / df['参加者数']) * 100
-            # 修正: 'not in in' を 'not in' に変更
-            if 'リアクション率' not in df.columns and '参加者数' in df.columns:
-                df['リアクション率'] = df['リアクション数'] / df['参加者数']
+def show_correlation_view():
+    st.header(get_localized_text("🔗 相関分析"))
 
-            df = DataProcessor.expand_time_slots(df)
+    df = DatasetView.current()
+    if df is not None:
 
-            st.subheader(get_localized_text("📣 参加者数を増やすためのデータ分析"))
+        numeric_cols = df.select_dtypes(include='number').columns.tolist()
+        if len(numeric_cols) < 2:
+            st.warning(get_localized_text("相関分析には数値列が2つ以上必要です。"))
+            st.stop()
 
-            def append_section_to_report(title_jp, df_to_use):
-                st.markdown(get_localized_text(f"#### {title_jp}"))
-                st.dataframe(df_to_use, use_container_width=True) # use_container_width=True を追加
+        method_map = {
+            get_localized_text('ピアソン'): 'pearson',
+            get_localized_text('スピアマン（順位）'): 'spearman'
+        }
+        no_group = get_localized_text('なし（全体）')
 
+        col1, col2 = st.columns(2)
+        with col1:
+            method_display = st.selectbox(get_localized_text("相関係数"), list(method_map), key="corr_method")
+            group_col = st.selectbox(
+                get_localized_text("グループ別に求める列"),
+                [no_group] + CorrelationEngine.group_columns(df),
+                key="corr_group"
+            )
+        with col2:
+            annotate = st.checkbox(get_localized_text("相関係数を表示"), value=True, key="corr_annot")
 
-            st.markdown(get_localized_text("### 🏆 ランキングまとめ"))
-            if '担当チーム' in df.columns and '参加者数' in df.columns:
-                team_avg = df.groupby("担当チーム")["参加者数"].mean().sort_values(ascending=False).reset_index()
-                append_section_to_report("参加者数が多いチーム", team_avg)
+        try:
+            # 全数値列の相関行列（グループ別なら全グループ分）をフィルター状態ごとに一度だけ計算する
+            results = CorrelationEngine.get(df, method_map[method_display], None if group_col == no_group else group_col)
+            if group_col == no_group:
+                group_label = None
             else:
-                st.info(get_localized_text("「担当チーム」または「参加者数」の列がありません。"))
+                if not results:
+                    st.info(get_localized_text(f"「{group_col}」に値がある行がありません。"))
+                    st.stop()
+                with col2:
+                    group_label = st.selectbox(get_localized_text("表示するグループ"), list(results), key="corr_group_value")
+
+            matrix = results[group_label]['matrix']
+            counts = results[group_label]['counts']
+            title = f"数値列の相関（{method_display}）" if group_label is None else f"{group_col}「{group_label}」の数値列の相関（{method_display}）"
+
+            ChartRenderer.show(ChartRenderer.spec(
+                'heatmap',
+                get_graph_text(title),
+                '',
+                '',
+                (12, 9),
+                title_font={'fontsize': 16},
+                cmap='coolwarm',
+                vmin=-1,
+                vmax=1,
+                annot=annotate,
+                rotation=45,
+                ha='right'
+            ), matrix)
+
+            st.caption(get_localized_text(
+                f"各列の組は両方に値がある行だけで計算しています（使用した行数: {counts.values.min()}〜{counts.values.max()}行）。"
+            ))
+
+            csv = matrix.to_csv(encoding='utf-8-sig').encode('utf-8-sig')
+            st.download_button(
+                get_localized_text("📥 相関行列をCSVで保存"),
+                csv,
+                file_name="correlation_matrix.csv",
+                mime='text/csv',
+                key="corr_download"
+            )
 
-            if '曜日' in df.columns and '参加者数' in df.columns:
-                weekday_avg = df.groupby("曜日")["参加者数"].mean().sort_values(ascending=False).reindex(index=['月', '火', '水', '木', '金', '土', '日']).dropna().reset_index()
-                append_section_to_report("曜日別の参加者数", weekday_avg)
+            st.subheader(get_localized_text("📊 相関の強い組み合わせ"))
+            pairs = CorrelationEngine.strongest_pairs(matrix, 5).dropna()
+            if pairs.empty:
+                st.info(get_localized_text("相関を計算できる列の組がありません（データ不足または定数）。"))
             else:
-                st.info(get_localized_text("「曜日」または「参加者数」の列がありません。"))
+                pairs = pairs.rename(columns={
+                    'column_a': get_localized_text('列1'),
+                    'column_b': get_localized_text('列2'),
+                    'corr': get_localized_text('相関係数')
+                }).reset_index(drop=True)
+                pairs.index += 1
+                st.dataframe(pairs.round(3), use_container_width=True)
 
-            if '時間帯スロット' in df.columns and '参加者数' in df.columns:
-                time_avg = df.groupby("時間帯スロット")["参加者数"].mean().sort_values(ascending=False).reset_index()
-                append_section_to_report("時間帯別の参加者数", time_avg)
-            else:
-                st.info(get_localized_text("「時間帯スロット」または「参加者数」の列がありません。"))
+        except Exception as e:
+            st.error(get_localized_text(f"相関分析中にエラーが発生: {e}"))
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
 
 
-            if '参加率(%)' in df.columns:
-                cols_for_top_rate = [col for col in ["イベント名", "曜日", "時間帯スロット", "参加率(%)"] if col in df.columns]
-                top_rate = df.sort_values("参加率(%)", ascending=False).head(5)[cols_for_top_rate].reset_index(drop=True)
-                top_rate.index += 1
-                append_section_to_report("参加率が高いイベント", top_rate)
-            else:
-                st.info(get_localized_text("「参加率(%)」の列がありません。"))
+def show_report_view():
+    st.header(get_localized_text("📋 自動レポート"))
 
-            if '満足率(%)' in df.columns:
-                cols_for_top_satisfaction = [col for col in ["イベント名", "曜日", "時間帯スロット", "満足率(%)"] if col in df.columns]
-                top_satisfaction = df.sort_values("満足率(%)", ascending=False).head(5)[cols_for_top_satisfaction].reset_index(drop=True)
-                top_satisfaction.index += 1
-                append_section_to_report("満足度が高いイベント", top_satisfaction)
-            else:
-                st.info(get_localized_text("「満足率(%)」の列がありません。"))
+    df = DatasetView.current()
+    if df is not None:
+
+        # 全セクションをフィルター状態ごとに一度だけ計算する
+        sections = ResultCache.get_or_compute('report', 'sections', lambda: ReportEngine.build(df))
+
+        st.subheader(get_localized_text("📣 参加者数を増やすためのデータ分析"))
+
+        def append_section_to_report(title_jp, df_to_use):
+            st.markdown(get_localized_text(f"#### {title_jp}"))
+            st.dataframe(df_to_use, use_container_width=True) # use_container_width=True を追加
 
-            if '曜日' in df.columns and '参加者数' in df.columns:
-                low_participation_raw = df.groupby("曜日")["参加者数"].mean().sort_values().reset_index()
-                low_participation = low_participation_raw.head(3).copy()
-                low_participation.index += 1
-                append_section_to_report("参加者数が少ない曜日", low_participation)
+
+        st.markdown(get_localized_text("### 🏆 ランキングまとめ"))
+        if sections['team_avg'] is not None:
+            append_section_to_report("参加者数が多いチーム", sections['team_avg'])
+        else:
+            st.info(get_localized_text("「担当チーム」または「参加者数」の列がありません。"))
+
+        if sections['weekday_avg'] is not None:
+            append_section_to_report("曜日別の参加者数", sections['weekday_avg'])
+        else:
+            st.info(get_localized_text("「曜日」または「参加者数」の列がありません。"))
+
+        if sections['time_avg'] is not None:
+            append_section_to_report("時間帯別の参加者数", sections['time_avg'])
+        else:
+            st.info(get_localized_text("「時間帯スロット」または「参加者数」の列がありません。"))
+
+
+        if sections['top_rate'] is not None:
+            append_section_to_report("参加率が高いイベント", sections['top_rate'])
+        else:
+            st.info(get_localized_text("「参加率(%)」の列がありません。"))
+
+        if sections['top_satisfaction'] is not None:
+            append_section_to_report("満足度が高いイベント", sections['top_satisfaction'])
+        else:
+            st.info(get_localized_text("「満足率(%)」の列がありません。"))
+
+        if sections['low_participation'] is not None:
+            append_section_to_report("参加者数が少ない曜日", sections['low_participation'])
+        else:
+            st.info(get_localized_text("「曜日」または「参加者数」の列がありません。"))
+
+        st.markdown(get_localized_text("### 💡 宣伝・リアクションと参加者数の関係"))
+
+        corr_summary_text = []
+        if '宣伝回数' in sections['corr']:
+            corr1 = sections['corr']['宣伝回数']
+            if pd.notna(corr1):
+                corr_summary_text.append(get_localized_text(f"「宣伝回数」と「参加者数」の相関: {corr1:.2f}"))
             else:
-                st.info(get_localized_text("「曜日」または「参加者数」の列がありません。"))
-
-            st.markdown(get_localized_text("### 💡 宣伝・リアクションと参加者数の関係"))
-            
-            corr_summary_text = []
-            if '宣伝回数' in df.columns and '参加者数' in df.columns:
-                corr1 = df['参加者数'].corr(df['宣伝回数'])
-                if pd.notna(corr1):
-                    corr_summary_text.append(get_localized_text(f"「宣伝回数」と「参加者数」の相関: {corr1:.2f}"))
-                else:
-                    corr_summary_text.append(get_localized_text("「宣伝回数」と「参加者数」の相関は計算できませんでした（データ不足または定数）。"))
+                corr_summary_text.append(get_localized_text("「宣伝回数」と「参加者数」の相関は計算できませんでした（データ不足または定数）。"))
+        else:
+            corr_summary_text.append(get_localized_text("「宣伝回数」の列が見つかりませんでした。"))
+
+        if 'リアクション率' in sections['corr']:
+            corr2 = sections['corr']['リアクション率']
+            if pd.notna(corr2):
+                corr_summary_text.append(get_localized_text(f"「リアクション率」と「参加者数」の相関: {corr2:.2f}"))
             else:
-                corr_summary_text.append(get_localized_text("「宣伝回数」の列が見つかりませんでした。"))
+                corr_summary_text.append(get_localized_text("「リアクション率」と「参加者数」の相関は計算できませんでした（データ不足または定数）。"))
+        else:
+            st.info(get_localized_text("「リアクション率」の列が見つかりませんでした。"))
+
+        for line in corr_summary_text:
+            st.info(line)
+
+
+    else:
+        st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
 
-            if 'リアクション率' in df.columns and '参加者数' in df.columns:
-                corr2 = df['参加者数'].corr(df['リアクション率'])
-                if pd.notna(corr2):
-                    corr_summary_text.append(get_localized_text(f"「リアクション率」と「参加者数」の相関: {corr2:.2f}"))
+
+# 画面（タブ）の登録: 選択中のタブの描画関数だけが実行される
+MAIN_VIEWS = [
+    (get_localized_text("📊 データ管理"), show_data_view),
+    (get_localized_text("📈 分析・比較"), show_analysis_view),
+    (get_localized_text("📊 クロス集計"), show_crosstab_view),
+    (get_localized_text("🕒 ヒートマップ"), show_heatmap_view),
+    (get_localized_text("📉 時系列"), show_trend_view),
+    (get_localized_text("🏆 ランキング"), show_ranking_view),
+    (get_localized_text("🔗 相関分析"), show_correlation_view),
+    (get_localized_text("📋 自動レポート"), show_report_view)
+]
+
+
+# メインダッシュボードの表示 (v1.0.0.py の main 関数を show_main_app にリネーム)
+def show_main_app():
+    # This style block should be removed or commented out as it might interfere with font settings
+    # st.markdown("""
+    # <style>
+    # @font-face {
+    # font-family: 'Noto Sans JP';
+    # src: url('/static/NotoSansJP-Thin.woff2') format('woff2');
+    # }
+    # body, div, p, span, input, label {
+    # font-family: 'Noto Sans JP', sans-serif !important;
+    # }
+    # </style>
+    # """, unsafe_allow_html=True)
+
+    st.title(get_localized_text("VRイベント分析アプリ"))
+
+    SessionManager.initialize()
+
+    with st.sidebar:
+        st.markdown(get_localized_text("## 🔍 フィルター設定"))
+        st.markdown("---")
+
+        dfmain_for_sidebar = st.session_state.get('dfmain')
+
+        if dfmain_for_sidebar is not None and not dfmain_for_sidebar.empty:
+            version = st.session_state.dataset_version
+            filter_index = FilterEngine.get_index(dfmain_for_sidebar, version)
+            selected_teams = []
+            selected_dates = None
+
+            if '担当チーム' in dfmain_for_sidebar.columns:
+                teams = list(filter_index['team_bitmaps'])
+                
+                # selected_teams の初期値をセッションステートから取得、なければ全選択
+                initial_selected_teams = st.session_state.get('selected_teams')
+                # selected_teams がNoneの場合、全チームを選択状態にする
+                if initial_selected_teams is None:
+                    initial_selected_teams = teams
+                
+                selected_teams = st.multiselect(
+                    get_localized_text("👥 担当チーム"), 
+                    teams, 
+                    default=[t for t in initial_selected_teams if t in teams] # 存在しないチームがdefaultに含まれないようにフィルタ
+                )
+                st.session_state.selected_teams = selected_teams # セッションステートに選択を保存
+
+                # 担当チームが何も選択されていない場合の動作変更
+                if len(selected_teams) == 0:
+                    st.warning(get_localized_text("担当チームが選択されていません。全ての担当チームのデータが表示されます。"))
+
+            if '実施日' in dfmain_for_sidebar.columns:
+                # 選択中のチームの行から最小・最大の日付を取得
+                bounds = FilterEngine.date_bounds(filter_index, FilterEngine.team_mask(filter_index, selected_teams))
+                if bounds is not None:
+                    min_date = pd.Timestamp(bounds[0]).date()
+                    max_date = pd.Timestamp(bounds[1]).date()
+                    
+                    default_date_range = [min_date, max_date] if min_date <= max_date else [min_date, min_date]
+                    date_range = st.date_input(get_localized_text("📅 実施日の範囲"), value=default_date_range)
+                    
+                    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+                        selected_dates = (date_range[0], date_range[1])
                 else:
-                    corr_summary_text.append(get_localized_text("「リアクション率」と「参加者数」の相関は計算できませんでした（データ不足または定数）。"))
-            else:
-                st.info(get_localized_text("「リアクション率」の列が見つかりませんでした。"))
-            
-            for line in corr_summary_text:
-                st.info(line)
+                    st.warning(get_localized_text("日付データがありません。"))
 
+            df_filtered = FilterEngine.apply(dfmain_for_sidebar, version, selected_teams, selected_dates)
+            st.session_state.filter_key = (version, tuple(selected_teams), selected_dates)
+            st.session_state.current_data = df_filtered
 
         else:
-            st.warning(get_localized_text("データがアップロードされていないか、フィルターによってデータがありません。データ管理タブでファイルをアップロードしてください。"))
+            st.info(get_localized_text("データをアップロードしてください"))
+
+        st.markdown("---")
+        st.checkbox(
+            get_localized_text("⚡ 近似統計モード（大規模データ向け）"),
+            key="approx_stats",
+            help=get_localized_text("列情報のユニーク値数と基本統計量の四分位数を、データセットごとに作るスケッチから近似的に求めます。")
+        )
+        st.number_input(
+            get_localized_text("並列処理のワーカー数"),
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            key="pool_workers",
+            help=get_localized_text("複数ファイルの読み込みと複数グラフの描画に使うプロセス数です。1 の場合は並列処理を行いません。")
+        )
+
+        figures = FigureManager.report()
+        st.caption(get_localized_text(
+            f"🖼️ 描画中の図: {figures['live']}（累計 {figures['created']}枚, {figures['rendered_bytes'] / 1024 / 1024:.1f}MB） / "
+            f"キャッシュ済みチャート: {figures['cached_charts']}件 {figures['cached_bytes'] / 1024 / 1024:.1f}MB"
+        ))
+
+    # on_change="rerun" で選択中のタブを追跡し、開いているタブの内容だけを計算する
+    tabs = st.tabs(
+        [label for label, _ in MAIN_VIEWS],
+        key="active_view",
+        on_change="rerun"
+    )
+
+    with tabs[0]:
+        show_upload_section()
+
+    for tab, (_, view) in zip(tabs, MAIN_VIEWS):
+        if tab.open:
+            with tab:
+                view()
 
 
 # --- アプリケーションのエントリポイント ---